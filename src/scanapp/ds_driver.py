@@ -1,19 +1,32 @@
+import array
+import datetime
+import os
+import queue
 import struct
 import threading
 import time
-from dataclasses import asdict, dataclass
-from io import BytesIO
+import tracemalloc
+from dataclasses import dataclass, field, fields
+from io import SEEK_CUR, SEEK_END, SEEK_SET, BytesIO, RawIOBase
 from pathlib import Path
-from typing import Generator, Literal
+from typing import Callable, ClassVar, Generator, Literal
 
+import usb.control
 import usb.core
 from PIL import Image
 
+from scanapp.env import SCANNER_RECORD_DIR
+from scanapp.usb_session import SessionRecorder, read_pages
+
 try:
     import RPi.GPIO as GPIO
 except ImportError:
     import Mock.GPIO as GPIO
 
+# Errors of a scan: USB and decoder errors (OSError), unexpected packets (asserts), a missing
+# device (ValueError) and a failed USB reader thread (RuntimeError)
+SCANNER_ERRORS = (OSError, AssertionError, ValueError, RuntimeError)
+
 PIN_ONOFF = 26
 PIN_BUTTON = 16
 PIN_PAPER = 19
@@ -33,6 +46,16 @@ SCAN_MAX_DURATION = 10
 SCAN_MAX_DURATION_LONG = 3 * SCAN_MAX_DURATION
 # Time after starting the scan, when to enable the motor
 MOTOR_WAKE_START_TIME = 1.0
+# Receive buffer for one page in chunks of the announced chunk size, grows if a page is larger
+PAGE_BUFFER_CHUNKS = 16
+# Maximum number of received chunks queued between USB reader and decoder
+PIPELINE_DEPTH = 64
+# Timeout [ms] for waiting on the next packet while scanning, aborting does not depend on it
+SCAN_POLL_TIMEOUT = 1000
+# Maximum duration until the scanner must acknowledge an abort
+ABORT_MAX_DURATION = 5
+# Timeout [ms] for reading stale replies before and after probing
+DRAIN_TIMEOUT = 50
 
 
 @dataclass
@@ -45,10 +68,11 @@ class SerializableScanParam:
                 return b",".join(_as_bytes(v) for v in val)
             return str(val).encode()
 
+        # Not asdict(), which deep-copies all values
         return b"".join(
-            key.encode() + b"=" + _as_bytes(value) + b"\n"
-            for key, value in asdict(self).items()
-            if value is not None
+            f.name.encode() + b"=" + _as_bytes(value) + b"\n"
+            for f in fields(self)
+            if (value := getattr(self, f.name)) is not None
         )
 
 
@@ -111,15 +135,298 @@ class SSPRequest(SerializableScanParam):
     ATFD: int | None = None
 
 
+class PageBuffer:
+    """Growable buffer, which receives the compressed data of one page chunk by chunk."""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def reserve(self, capacity: int) -> None:
+        """Allocates at least capacity bytes up front, so appending does not reallocate."""
+        if capacity > len(self._data):
+            self._data += bytes(capacity - len(self._data))
+
+    def append(self, data: bytes | memoryview) -> None:
+        end = self._size + len(data)
+        if end > len(self._data):
+            # Grow by doubling, so a long page only reallocates a few times
+            self._data += bytes(max(end, 2 * len(self._data)) - len(self._data))
+        self._data[self._size : end] = data
+        self._size = end
+
+    def view(self) -> memoryview:
+        """The received data. Must be released before appending more data."""
+        return memoryview(self._data)[: self._size]
+
+    def clear(self) -> None:
+        self._size = 0
+
+
+class BufferReader(RawIOBase):
+    """Read-only file object on a buffer, to decode received data without copying it first."""
+
+    def __init__(self, data: memoryview):
+        self._view = data
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size < 0 else min(len(self._view), self._pos + size)
+        res = bytes(self._view[self._pos : end])
+        self._pos = max(self._pos, end)
+        return res
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        if whence == SEEK_CUR:
+            offset += self._pos
+        elif whence == SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        self._view = memoryview(b"")
+        super().close()
+
+
+def decode_page(data: memoryview, height: int = 0) -> Image.Image:
+    """Decodes a received page and crops it to the given height (if not 0)."""
+    with BufferReader(data) as fp:
+        img = Image.open(fp)
+        img.load()
+    if height > 0:
+        img = img.crop((0, 0, img.width, height))
+    return img
+
+
+@dataclass
+class PageChunk:
+    pagenum: int
+    compression: int
+    # Height of the page, only set with the last chunk
+    height: int
+    # All data of the page received so far
+    data: PageBuffer
+    last: bool
+
+
+@dataclass
+class PageBand:
+    pagenum: int
+    # The page, only decoded up to `bottom` unless final
+    image: Image.Image
+    # Rows [top, bottom) were decoded since the previous band
+    top: int
+    bottom: int
+    final: bool
+
+    def band(self) -> Image.Image:
+        return self.image.crop((0, self.top, self.image.width, self.bottom))
+
+
+@dataclass
+class RawPage:
+    """A received page in the compressed form sent by the scanner, decoded only on demand."""
+
+    pagenum: int
+    compression: int
+    # Height of the page, the compressed image may contain padding rows below. 0 if unknown.
+    height: int
+    data: bytes = field(repr=False)
+
+    _image: Image.Image | None = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def is_jpeg(self) -> bool:
+        return self.data[:2] == b"\xff\xd8"
+
+    def image(self) -> Image.Image:
+        """Decodes the page (once) and crops it to its height."""
+        if self._image is None:
+            self._image = decode_page(memoryview(self.data), self.height)
+        return self._image
+
+
+class ProgressiveDecoder:
+    """
+    Decodes a JPEG page while its data is still being received.
+    PIL's ImageFile.Parser does not decode JPEG incrementally, thus this drives the decoder
+    directly, feeding it from the page buffer without accumulating copies of the data.
+    Without PIL's decoder API, the page is decoded as a whole when complete.
+    """
+
+    image: Image.Image | None = None
+    # Number of rows decoded so far
+    rows: int = 0
+
+    # Image filled with a pattern, which a decoded JPEG row never matches, by mode and size
+    _sentinels: ClassVar[dict[tuple[str, tuple[int, int]], Image.Image]] = {}
+
+    def __init__(self):
+        self._decoder = None
+        self._pos = 0
+        self._incremental = True
+        self._done = False
+        self._sentinel_row = b""
+
+    @classmethod
+    def _sentinel(cls, mode: str, size: tuple[int, int]) -> Image.Image:
+        img = cls._sentinels.get((mode, size))
+        if img is None:
+            # Alternating full scale pixels (and channels), JPEG cannot reproduce them exactly
+            bands = len(mode)
+            pixel = bytes([0, 255, 0, 255][:bands]) + bytes([255, 0, 255, 0][:bands])
+            row = (pixel * ((size[0] + 1) // 2))[: size[0] * bands]
+            img = cls._sentinels[(mode, size)] = Image.frombytes(mode, size, row * size[1])
+        return img
+
+    def _open(self, data: memoryview) -> None:
+        getdecoder = getattr(Image, "_getdecoder", None)
+        with BufferReader(data) as fp:
+            try:
+                img = Image.open(fp)
+            except (OSError, SyntaxError):
+                # Header is incomplete, wait for more data
+                return
+            if getdecoder is None or img.format != "JPEG" or len(img.tile) != 1:
+                self._incremental = False
+                return
+            img.load_prepare()
+            decoder_name, extents, offset, args = img.tile[0]
+            img.tile = []
+        # Undecoded rows keep the pattern
+        sentinel = self._sentinel(img.mode, img.size)
+        img.paste(sentinel)
+        self._sentinel_row = sentinel.crop((0, 0, img.width, 1)).tobytes()
+        try:
+            self._decoder = getdecoder(img.mode, decoder_name, args, img.decoderconfig)
+            self._decoder.setimage(img.im, extents)
+        except (AttributeError, TypeError, ValueError, OSError) as e:
+            # The private decoder API of PIL changed, decode the complete page instead
+            print(f"No progressive decoding: {e!r}")
+            self._decoder = None
+            self._incremental = False
+            return
+        self._pos = offset
+        self.image = img
+
+    def _decoded_rows(self) -> int:
+        # Rows are decoded top to bottom, the undecoded ones still match the pattern
+        lo, hi = self.rows, self.image.height
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.image.crop((0, mid, self.image.width, mid + 1)).tobytes() == self._sentinel_row:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _decode(self, data: memoryview | bytes) -> None:
+        n, err = self._decoder.decode(data)
+        if n < 0:
+            self._done = True
+            self._decoder.cleanup()
+            if err < 0:
+                raise OSError(f"Decoder error {err}")
+        else:
+            self._pos += n
+
+    def feed(self, buf: PageBuffer) -> None:
+        if not self._incremental or self._done:
+            return
+        data = buf.view()
+        if self._decoder is None:
+            self._open(data)
+            if self._decoder is None:
+                return
+        if self._pos < len(data):
+            self._decode(data[self._pos :])
+        self.rows = self._decoded_rows()
+
+    def finish(self, buf: PageBuffer, height: int) -> Image.Image:
+        """Decodes the rest of the page, when all data was received."""
+        self.feed(buf)
+        if self._decoder is not None and not self._done:
+            # Like PIL, terminate the stream if the EOI marker is missing
+            self._decode(b"\xff\xd9")
+        if not self._done:
+            # Could not decode incrementally
+            return decode_page(buf.view(), height)
+        img = self.image
+        if height > 0:
+            img = img.crop((0, 0, img.width, height))
+        return img
+
+
+class CancelToken:
+    """Cancels a running scan from any thread."""
+
+    requested_at: float | None = None
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> bool:
+        """Returns True, if it was not cancelled before."""
+        if self._event.is_set():
+            return False
+        self.requested_at = time.monotonic()
+        self._event.set()
+        return True
+
+    def elapsed(self) -> float:
+        """Seconds since cancelling."""
+        assert self.requested_at is not None
+        return time.monotonic() - self.requested_at
+
+
 class DSDriver:
     dev: usb.core.Device
+    # Token of the currently running scan
+    _cancel: CancelToken | None = None
+    # Whether the scan job was sent for the current token
+    _scan_started: bool = False
+    # Duration from cancel() until the scanner confirmed the abort
+    last_abort_latency: float | None = None
+    # Encoded parameters last sent with SSP, None if unknown
+    _parameters: bytes | None = None
+    # Duration of the last SSP round trip
+    _parameters_duration: float = 0
+
+    def __init__(self, dev: usb.core.Device | None = None):
+        # Writes may come from the reader thread and from cancel()
+        self._write_lock = threading.RLock()
+
+        if dev is not None:
+            # Already set up, e.g. a replayed session
+            self.dev = dev
+            return
 
-    def __init__(self):
         # find our device
         self.dev = usb.core.find(idVendor=0x04F9, idProduct=0x0468)
 
-        self.aborting = False
-
         # was it found?
         if self.dev is None:
             raise ValueError("Device not found")
@@ -137,12 +444,55 @@ class DSDriver:
         self.user_read_ep = self.user_interface[1]
         assert self.user_read_ep.bEndpointAddress == 0x83
 
+        if SCANNER_RECORD_DIR:
+            os.makedirs(SCANNER_RECORD_DIR, exist_ok=True)
+            filename = f"session_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.dsusb"
+            self.dev = SessionRecorder(self.dev, Path(SCANNER_RECORD_DIR) / filename)
+
     def close(self):
         self.dev.finalize()
 
+    def reset_usb(self) -> None:
+        """Resets the USB port of the device. It enumerates again and must be reopened."""
+        self.invalidate_parameters()
+        self.dev.reset()
+
+    def is_alive(self) -> bool:
+        """Checks if the device still answers, i.e. was not power cycled since opening."""
+        try:
+            usb.control.get_status(self.dev)
+        except usb.core.USBError as e:
+            print(f"Device not alive: {e!r}")
+            return False
+        return True
+
+    def probe(self, timeout: int = 500) -> bool:
+        """Checks if the scanner answers a command, i.e. finished booting or waking up."""
+        try:
+            # A reply to an earlier probe may have arrived after its read timed out
+            self._drain()
+            self._user_write(b"\x1bS\nADF\n\x80", timeout)
+            res = self._user_read(1, timeout)
+            if res == b"\x80":
+                self._drain()
+        except usb.core.USBError as e:
+            print(f"Probe failed: {e!r}")
+            return False
+        return res == b"\x80"
+
+    def _drain(self) -> None:
+        """Discards the data pending on the IN endpoint, so it is not read as the next reply."""
+        while True:
+            try:
+                r = self.dev.read(0x83, 1024, DRAIN_TIMEOUT)
+            except usb.core.USBTimeoutError:
+                return
+            print(f"Discarded {len(r)} stale bytes: {bytes(r[:64])}")
+
     def _user_write(self, data: bytes, timeout: int = 1000) -> None:
         print(">>> ", data)
-        self.dev.write(0x04, data, timeout)
+        with self._write_lock:
+            self.dev.write(0x04, data, timeout)
         # self.user_write_ep.write(data)
 
     def _user_read(self, size: int, timeout: int = 5000) -> bytes:
@@ -151,6 +501,12 @@ class DSDriver:
         print("<<< ", r[:64])
         return r
 
+    def _user_read_chunk(self, size: int, timeout: int = 5000) -> array.array:
+        """Like _user_read, but returns the array as received from pyusb without copying."""
+        r = self.dev.read(0x83, size, timeout)
+        print("<<< ", bytes(r[:64]))
+        return r
+
     def set_source_d(self, source: Literal[b"ADF"] = b"ADF"):
         self._user_write(b"\x1bD\n" + source + b"\n\x80")
         res = self._user_read(1)
@@ -177,25 +533,48 @@ class DSDriver:
         res = self._user_read(1)
         assert res == b"\x80", res
 
-    def decode_imghdr(self, data: bytes) -> tuple[int, int, int, int, int]:
+    def decode_imghdr(self, data: bytes) -> tuple[int, int, int, int]:
         pagenum, compression, _, chunk_size, height = struct.unpack("<HBBII", data)
         return pagenum, compression, chunk_size, height
 
-    def scan(self, req: XSCRequest) -> Generator[Image.Image, None, None]:
+    def cancel(self) -> None:
+        """
+        Cancels the running scan (from any thread). The abort is sent right away, the scan
+        generator ends as soon as the scanner confirms it.
+        """
+        with self._write_lock:
+            if self._cancel is None or not self._cancel.cancel():
+                return
+            if self._scan_started:
+                print("Aborting softly")
+                self._user_write(b"\x1bABT\nEJCT=NO\n\x80")
+
+    def _read_chunks(
+        self,
+        req: XSCRequest,
+        cancel: CancelToken,
+        on_chunk: Callable[[tuple[int, int, int, array.array]], None],
+    ) -> bool:
+        """
+        Runs the scan job, calls on_chunk with (pagenum, compression, height, data) for every
+        received chunk of image data. Returns False if the scan was aborted.
+        """
         # Scanjob
-        self._user_write(b"\x1bXSC\n" + req.to_bytes() + b"\n\x80")
-        self.aborting = False
+        with self._write_lock:
+            self._user_write(b"\x1bXSC\n" + req.to_bytes() + b"\n\x80")
+            self._scan_started = True
+            if cancel.cancelled:
+                print("Aborting softly")
+                self._user_write(b"\x1bABT\nEJCT=NO\n\x80")
 
-        img_data = []
         while True:
             # Receive a response header
             try:
-                packet = self._user_read(1024, 100)
+                packet = self._user_read(1024, SCAN_POLL_TIMEOUT)
             except usb.core.USBTimeoutError:
-                if self.aborting:
-                    print("Aborting softly")
-                    self._user_write(b"\x1bABT\nEJCT=NO\n\x80")
-                    self.aborting = False
+                if cancel.cancelled and cancel.elapsed() > ABORT_MAX_DURATION:
+                    print(f"Abort not confirmed after {cancel.elapsed():.1f}s, giving up")
+                    return False
                 continue
             cmd = packet[0]
             if cmd == 0x00:
@@ -205,12 +584,7 @@ class DSDriver:
                     print(
                         f"Chunk package pagenum={pagenum} compression={compression} chunk_size={chunk_size} height={height}"
                     )
-                    img_data.append(self._user_read(chunk_size))
-                    if height > 0:
-                        img = Image.open(BytesIO(b"".join(img_data)))
-                        img_data.clear()
-                        img = img.crop((0, 0, img.width, height))
-                        yield img
+                    on_chunk((pagenum, compression, height, self._user_read_chunk(chunk_size)))
                 elif detail == 0x21:
                     # Done
                     pagenum = struct.unpack("<H", packet[2:])
@@ -241,10 +615,14 @@ class DSDriver:
                 elif detail == 0x40:
                     # Probably aborted
                     # internal: 0x4002
-                    print("Aborted")
+                    if cancel.cancelled:
+                        self.last_abort_latency = cancel.elapsed()
+                        print(f"Aborted, {self.last_abort_latency * 1000:.0f}ms after cancel")
+                    else:
+                        print("Aborted")
                     assert len(packet) == 2
                     # Do not yield any received data.
-                    return
+                    return False
                 elif detail == 0x51:
                     # error happen
                     print("Some error")
@@ -259,23 +637,143 @@ class DSDriver:
                 # This is unexpected
                 assert False, packet
 
-        if len(img_data) > 0:
-            yield Image.open(BytesIO(b"".join(img_data)))
+        return True
+
+    def _receive(self, req: XSCRequest) -> Generator[PageChunk, None, None]:
+        """
+        Runs the scan job, yields after every received chunk of image data.
+        The USB endpoint is read by a separate thread, which queues the chunks, so it is not
+        idle while the chunks are assembled and decoded here.
+        """
+        chunks = queue.Queue(maxsize=PIPELINE_DEPTH)
+        stop = threading.Event()
+        completed = False
+        cancel = CancelToken()
+        with self._write_lock:
+            self._cancel = cancel
+            self._scan_started = False
+
+        def _put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def _reader():
+            nonlocal completed
+            # Unless replaced, an unexpected error ends this thread (and is printed by it)
+            result = RuntimeError("USB reader failed")
+            try:
+                completed = self._read_chunks(req, cancel, _put)
+                result = None
+            except SCANNER_ERRORS as e:
+                result = e
+            finally:
+                # Always ends the consumer
+                _put(result)
+
+        t_reader = threading.Thread(target=_reader, name="usb_reader")
+        t_reader.start()
+        img_data = PageBuffer()
+        pagenum = compression = 0
+        try:
+            while (item := chunks.get()) is not None:
+                if isinstance(item, BaseException):
+                    # Unknown state of the scanner, send the parameters again next time
+                    self.invalidate_parameters()
+                    raise item
+                pagenum, compression, height, data = item
+                if len(img_data) == 0:
+                    # Sized by the chunk size from the header, the buffer is reused for all pages
+                    img_data.reserve(PAGE_BUFFER_CHUNKS * len(data))
+                img_data.append(data)
+                yield PageChunk(pagenum, compression, height, img_data, last=height > 0)
+                if height > 0:
+                    img_data.clear()
+        finally:
+            if t_reader.is_alive():
+                # Stopped early, abort the scan and discard the rest
+                print("Receiver closed, aborting scan")
+                stop.set()
+                self.cancel()
+            t_reader.join()
+            with self._write_lock:
+                self._cancel = None
+                self._scan_started = False
+
+        if completed and len(img_data) > 0:
+            yield PageChunk(pagenum, compression, 0, img_data, last=True)
+
+    def scan(self, req: XSCRequest) -> Generator[Image.Image, None, None]:
+        for chunk in self._receive(req):
+            if chunk.last:
+                yield decode_page(chunk.data.view(), chunk.height)
+
+    def scan_raw(self, req: XSCRequest) -> Generator[RawPage, None, None]:
+        """Like scan(), but yields the pages without decoding them."""
+        for chunk in self._receive(req):
+            if chunk.last:
+                yield RawPage(
+                    chunk.pagenum, chunk.compression, chunk.height, bytes(chunk.data.view())
+                )
+
+    def scan_progressive(self, req: XSCRequest) -> Generator[PageBand, None, None]:
+        """Like scan(), but decodes while receiving and yields the rows decoded so far."""
+        decoder = None
+        for chunk in self._receive(req):
+            if decoder is None:
+                decoder = ProgressiveDecoder()
+            top = decoder.rows
+            decoder.feed(chunk.data)
+            if chunk.last:
+                img = decoder.finish(chunk.data, chunk.height)
+                decoder = None
+                yield PageBand(chunk.pagenum, img, top, img.height, final=True)
+            elif decoder.rows > top:
+                yield PageBand(chunk.pagenum, decoder.image, top, decoder.rows, final=False)
+
+    def invalidate_parameters(self) -> None:
+        """Sends the parameters with the next set_parameters, even if unchanged."""
+        self._parameters = None
 
     def set_parameters(self, req: SSPRequest):
-        self._user_write(b"\x1bSSP\n" + req.to_bytes() + b"\n\x80")
+        data = req.to_bytes()
+        if data == self._parameters:
+            print(
+                f"Parameters unchanged, skipped SSP (saves {self._parameters_duration * 1000:.0f}ms)"
+            )
+            return
+        start = time.monotonic()
+        self._parameters = None
+        self._user_write(b"\x1bSSP\n" + data + b"\n\x80")
         packet = self._user_read(1024, 1000)
         assert packet[0] == 0x00, packet
         assert len(packet) == 0x26, packet
+        self._parameters = data
+        self._parameters_duration = time.monotonic() - start
 
 
 class DSDriverEmulator:
     def __init__(self):
-        pass
+        self._cancel = threading.Event()
 
     def close(self):
         pass
 
+    def is_alive(self) -> bool:
+        return True
+
+    def reset_usb(self) -> None:
+        pass
+
+    def probe(self) -> bool:
+        return True
+
+    def invalidate_parameters(self) -> None:
+        pass
+
     def set_source_d(self, source: Literal[b"ADF"] = b"ADF"):
         pass
 
@@ -286,8 +784,22 @@ class DSDriverEmulator:
         pass
 
     def scan(self, req: XSCRequest) -> Generator[Image.Image, None, None]:
-        time.sleep(3)
-        yield Image.open(BytesIO((Path(__file__).parent / "testscan.jpg").read_bytes()))
+        for page in self.scan_raw(req):
+            yield page.image()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def scan_raw(self, req: XSCRequest) -> Generator[RawPage, None, None]:
+        self._cancel.clear()
+        if self._cancel.wait(3):
+            print("Aborted")
+            return
+        yield RawPage(0, 0, 0, (Path(__file__).parent / "testscan.jpg").read_bytes())
+
+    def scan_progressive(self, req: XSCRequest) -> Generator[PageBand, None, None]:
+        for img in self.scan(req):
+            yield PageBand(0, img, 0, img.height, final=True)
 
     def set_parameters(self, req: SSPRequest):
         pass
@@ -299,13 +811,14 @@ def dbg_usb_scan():
 
     def _scan_thread():
         drv.set_parameters(SSPRequest(RESO=(150, 150), LONG="ON", ATCN="OFF", ATFD=None))
-        for page in drv.scan(
+        for page in drv.scan_raw(
             XSCRequest(
                 RESO=(150, 150),
                 AREA=(0, 0, 1275, 1650),
             )
         ):
-            page.save("dump.jpg", quality=90)
+            # Store as received, the padding rows below page.height are kept
+            Path("dump.jpg").write_bytes(page.data)
 
     t = threading.Thread(target=_scan_thread)
 
@@ -315,12 +828,65 @@ def dbg_usb_scan():
         t.join()
     except KeyboardInterrupt:
         print("Cancelled, aborting scan immediately")
-        drv.aborting = True
+        drv.cancel()
         t.join()
     finally:
         print(f"Dur: {time.time() - start}")
 
 
+def dbg_page_assembly(
+    path: Path = Path(__file__).parent / "testscan.jpg", chunk_size: int = 0x10000
+):
+    """
+    Compares memory and time of joining chunk bytes with receiving into a PageBuffer, for the
+    assembly alone and including decoding.
+    Path is either an image, which is split into chunks, or a recorded session.
+    """
+    if path.suffix == ".dsusb":
+        pages = read_pages(path)
+    else:
+        data = path.read_bytes()
+        pages = [(1000, [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)])]
+
+    def _joined(decode: bool):
+        for height, chunks in pages:
+            img_data = []
+            for chunk in chunks:
+                img_data.append(bytes(array.array("B", chunk)))
+            joined = b"".join(img_data)
+            if decode:
+                img = Image.open(BytesIO(joined))
+                img.crop((0, 0, img.width, height))
+
+    # Like in scan(), the page buffer is reused for all pages of a scan
+    img_data = PageBuffer()
+
+    def _buffered(decode: bool):
+        for height, chunks in pages:
+            img_data.clear()
+            img_data.reserve(PAGE_BUFFER_CHUNKS * len(chunks[0]))
+            for chunk in chunks:
+                img_data.append(array.array("B", chunk))
+            if decode:
+                decode_page(img_data.view(), height)
+
+    size = sum(len(chunk) for _, chunks in pages for chunk in chunks)
+    for decode in (False, True):
+        for name, fn in (("join", _joined), ("buffer", _buffered)):
+            fn(decode)
+            tracemalloc.start()
+            start = time.perf_counter()
+            for _ in range(10):
+                fn(decode)
+            dur = (time.perf_counter() - start) / 10 / len(pages)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{name}{' + decode' if decode else ''}: {dur * 1000:.2f}ms/page, "
+                f"peak {peak / 1024:.0f}KiB for {size} bytes"
+            )
+
+
 def dbg_outer_scan():
     GPIO.setmode(GPIO.BCM)
     GPIO.setup(PIN_ONOFF, GPIO.OUT)
@@ -404,7 +970,7 @@ def dbg_outer_scan():
         except KeyboardInterrupt:
             # On keyboard interrupt, just make the scanner abort.
             print("Set aborting")
-            # drv.aborting = True
+            # drv.cancel()
             GPIO.output(PIN_PAPER, False)
             time.sleep(0.5)
             print("Join scan thread")
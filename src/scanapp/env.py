@@ -23,3 +23,21 @@ MAIL_USER = os.environ.get("MAIL_USER")
 MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
 DISABLE_IBAN_CHECK = bool(os.environ.get("DISABLE_IBAN_CHECK", ""))
 EMULATE_SCANNER = bool(os.environ.get("EMULATE_SCANNER", ""))
+# Record the USB traffic of the scanner to session files in this directory
+SCANNER_RECORD_DIR = os.environ.get("SCANNER_RECORD_DIR")
+# Replay this recorded USB session file instead of talking to the scanner
+SCANNER_REPLAY = os.environ.get("SCANNER_REPLAY")
+# Power up the scanner on any input on the start page and adapt the power saving timeout to usage
+SCANNER_WARMUP = bool(os.environ.get("SCANNER_WARMUP", ""))
+# Show the result and accept the next sheet while the previous one is still processed
+SCAN_AHEAD = bool(os.environ.get("SCAN_AHEAD", ""))
+# Run the scanner control and USB driver in a separate process
+SCANNER_PROCESS = bool(os.environ.get("SCANNER_PROCESS", ""))
+# Number of threads for calibrating and cropping the bands of a scanned page in parallel
+SCAN_WORKERS = int(os.environ.get("SCAN_WORKERS", str(os.cpu_count() or 1)))
+# Directory for the finished pages of a session (e.g. a tmpfs), defaults to the system temp dir
+PAGE_STORE_DIR = os.environ.get("PAGE_STORE_DIR")
+# Bytes per output page, the encoder picks format and quality to fit
+PAGE_BYTE_BUDGET = int(os.environ.get("PAGE_BYTE_BUDGET", str(100 * 1024)))
+# Save each received page as last.jpg in the working directory (for debugging the stitcher)
+SAVE_LAST_SCAN = bool(os.environ.get("SAVE_LAST_SCAN", ""))
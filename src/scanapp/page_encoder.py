@@ -0,0 +1,149 @@
+import io
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, features
+
+from scanapp.env import PAGE_BYTE_BUDGET
+
+# Quality of the trial encode, the former default. Thus no page gets larger than before
+QUALITY_MAX = 75
+# Size relative to QUALITY_MAX per lower quality, upper bound over gray, colour and uncropped
+# scans (dbg_output_bench). The lowest is still legible for receipts
+QUALITY_SIZES = {70: 0.93, 65: 0.85, 60: 0.79, 55: 0.75, 50: 0.69}
+# Quality of the single WebP attempt, if even the lowest JPEG quality exceeds the budget
+WEBP_QUALITY = 75
+# Longest side of the downsampled copy for the content probe
+PROBE_SIZE = 256
+# Chroma (max - min of the channels) of a pixel, which counts as colour (scanner noise is below)
+COLOR_CHROMA = 48
+# Fraction of colour pixels, from which a page is encoded in colour (e.g. stamps, logos). The
+# calibration leaves colour fringes along dark to white edges of ~0.5% on the test scan
+COLOR_FRACTION = 0.01
+WEBP_SUPPORTED = features.check("webp")
+
+
+@dataclass
+class OutputFormat:
+    name: str
+    pil_format: str
+    mode: str
+    suffix: str
+    mime_sub: str
+    params: dict = field(default_factory=dict)
+
+
+# 4:2:0 with optimized huffman tables: 12% smaller for 4ms (dbg_encoder_bench)
+JPEG_COLOR = OutputFormat(
+    "jpeg", "JPEG", "RGB", ".jpg", "jpeg", {"subsampling": 2, "optimize": True}
+)
+JPEG_GRAY = OutputFormat("jpeg-gray", "JPEG", "L", ".jpg", "jpeg", {"optimize": True})
+# 2-3x smaller than JPEG for scans, but 5x slower to encode. Method 2 of 0 (fast) to 6 (small)
+WEBP = OutputFormat("webp", "WEBP", "RGB", ".webp", "webp", {"method": 2})
+
+MIME_TYPES = {fmt.suffix: ("image", fmt.mime_sub) for fmt in (JPEG_COLOR, WEBP)}
+
+
+def is_gray(img: Image.Image) -> bool:
+    """Probes a downsampled copy of the page for colour content."""
+    small = img.reduce(max(1, max(img.size) // PROBE_SIZE))
+    px = np.asarray(small, dtype=np.int16)
+    chroma = px.max(axis=2) - px.min(axis=2)
+    return np.count_nonzero(chroma >= COLOR_CHROMA) < COLOR_FRACTION * chroma.size
+
+
+def _encode(img: Image.Image, fmt: OutputFormat, quality: int) -> bytes:
+    dst = io.BytesIO()
+    img.save(dst, format=fmt.pil_format, quality=quality, **fmt.params)
+    return dst.getvalue()
+
+
+def estimate_quality(size: int, budget: int) -> int | None:
+    """Highest quality, which fits the budget by the size at QUALITY_MAX, None if none does."""
+    for quality, rel_size in QUALITY_SIZES.items():
+        if size * rel_size <= budget:
+            return quality
+    return None
+
+
+def encode_page(img: Image.Image, base: Path, budget: int = PAGE_BYTE_BUDGET) -> Path:
+    """
+    Encodes the page within the byte budget with at most a few encodes. Gray pages are encoded as
+    grayscale JPEG. A trial encode at QUALITY_MAX is kept if it fits, otherwise the quality is
+    estimated from its size. Only if no legible JPEG fits, a single WebP encode is tried.
+    Returns the written path, i.e. base with the suffix of the format.
+    """
+    start = time.perf_counter()
+    fmt = JPEG_GRAY if is_gray(img) else JPEG_COLOR
+    src = img.convert(fmt.mode)
+    quality = QUALITY_MAX
+    data = _encode(src, fmt, quality)
+    encodes = 1
+    if len(data) > budget:
+        estimated = estimate_quality(len(data), budget)
+        quality = estimated or min(QUALITY_SIZES)
+        data = _encode(src, fmt, quality)
+        encodes += 1
+        if estimated is None and WEBP_SUPPORTED:
+            webp_data = _encode(src, WEBP, WEBP_QUALITY)
+            encodes += 1
+            if len(webp_data) < len(data):
+                fmt, quality, data = WEBP, WEBP_QUALITY, webp_data
+    path = base.with_suffix(fmt.suffix)
+    path.write_bytes(data)
+    print(
+        f"Encoded {path.name} as {fmt.name} quality={quality}: {len(data) / 1024:.0f}KiB "
+        f"of {budget / 1024:.0f}KiB budget, {encodes} encodes in "
+        f"{(time.perf_counter() - start) * 1000:.1f}ms"
+    )
+    return path
+
+
+def dbg_output_bench(path: Path = Path(__file__).parent / "testscan.jpg", runs: int = 3):
+    """
+    Compares the output encoder with the former default colour JPEG on the test scan, and a copy
+    with a colour stamp, at different budgets. Run on the Pi for the encode times there.
+    """
+    import tempfile
+
+    from scanapp.stitcher import ScanCollector
+
+    sc = ScanCollector((100, 100), workers=1)
+    sc.append(Image.open(path).convert("RGB"))
+    page = sc.cur_image()
+    stamp = page.copy()
+    stamp.paste((200, 40, 40), (50, 100, 250, 200))
+    uncropped = Image.open(path).convert("RGB")
+    for name, img, fmt in (
+        ("gray", page, JPEG_GRAY),
+        ("colour", page, JPEG_COLOR),
+        ("uncropped", uncropped, JPEG_COLOR),
+    ):
+        src = img.convert(fmt.mode)
+        size = len(_encode(src, fmt, QUALITY_MAX))
+        rel_sizes = {q: round(len(_encode(src, fmt, q)) / size, 2) for q in QUALITY_SIZES}
+        print(f"{name}: size relative to quality {QUALITY_MAX}: {rel_sizes}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, img in (("gray", page), ("stamp", stamp)):
+            start = time.perf_counter()
+            for _ in range(runs):
+                ref = _encode(img, OutputFormat("ref", "JPEG", "RGB", ".jpg", "jpeg"), 75)
+            ref_dur = (time.perf_counter() - start) / runs
+            print(f"{name}: former JPEG {len(ref) / 1024:.0f}KiB in {ref_dur * 1000:.1f}ms")
+            for budget in (150 * 1024, 70 * 1024, 30 * 1024):
+                start = time.perf_counter()
+                for _ in range(runs):
+                    out = encode_page(img, Path(tmp) / name, budget)
+                dur = (time.perf_counter() - start) / runs
+                size = out.stat().st_size
+                print(
+                    f"{name} budget {budget // 1024}KiB: {out.suffix} {size / 1024:.0f}KiB, "
+                    f"saved {(len(ref) - size) / 1024:.0f}KiB ({1 - size / len(ref):.0%}), "
+                    f"{dur * 1000:.1f}ms"
+                )
+
+
+if __name__ == "__main__":
+    dbg_output_bench()
@@ -0,0 +1,43 @@
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+from scanapp.env import PAGE_STORE_DIR
+
+
+class PageStore:
+    """
+    Keeps the finished pages of a session as files in a temporary directory (e.g. on a tmpfs)
+    instead of in memory. The directory is removed on cleanup or when the store is collected.
+    """
+
+    def __init__(self, directory: str | None = PAGE_STORE_DIR):
+        self._dir = tempfile.TemporaryDirectory(prefix="scanapp_pages_", dir=directory)
+        self.paths: list[Path] = []
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self) -> Iterator[Path]:
+        return iter(self.paths)
+
+    def add(self) -> Path:
+        """Reserves the next page, its file is written with the suffix of the encoded format."""
+        path = Path(self._dir.name) / f"page_{len(self.paths)}"
+        self.paths.append(path)
+        return path
+
+    def written(self, path: Path, written: Path):
+        """The page reserved as path was written to the file written."""
+        self.paths[self.paths.index(path)] = written
+
+    def open(self, idx: int) -> BinaryIO:
+        return open(self.paths[idx], "rb")
+
+    def size(self) -> int:
+        """Total bytes of all pages."""
+        return sum(path.stat().st_size for path in self.paths)
+
+    def cleanup(self):
+        self._dir.cleanup()
@@ -1,7 +1,14 @@
+import heapq
 import os
+import queue
 import threading
 import time
+import traceback
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 from enum import Enum
+from pathlib import Path
 from typing import Callable, Generator
 
 from PIL import Image
@@ -11,8 +18,16 @@ try:
 except ImportError:
     import Mock.GPIO as GPIO
 
-from scanapp.ds_driver import DSDriver, DSDriverEmulator, SSPRequest, XSCRequest
-from scanapp.env import EMULATE_SCANNER
+from scanapp.ds_driver import (
+    SCANNER_ERRORS,
+    DSDriver,
+    DSDriverEmulator,
+    SSPRequest,
+    XSCRequest,
+)
+from scanapp.env import EMULATE_SCANNER, SCANNER_REPLAY
+from scanapp.stitcher import PageEndDetector
+from scanapp.usb_session import SessionReplay
 
 PIN_ONOFF = 26
 PIN_BUTTON = 16
@@ -20,12 +35,16 @@ PIN_PAPER = 19
 PIN_MOTOR_AWAKE = 12
 # 10min is default power saving timeout
 POWERSAVING_TIMEOUT = 10 * 60
-# About 4sec for booting from powerdown state
+# At most 4sec for booting from powerdown state
 STARTUP_RESUME_DURATION = 4
-# About 7sec for startup from no power
+# At most 7sec for startup from no power
 STARTUP_DURATION = 7
+# Interval for probing if the scanner is ready while starting up
+READY_POLL_INTERVAL = 0.25
 # Delay until starting the scanner again
 RESTART_DELAY = 1
+# Maximum duration for the scanner to enumerate again after a USB reset
+USB_RESET_TIMEOUT = 5
 # Maximum duration for a scan, before the scanner needs an "end_paper of paper"
 SCAN_MAX_DURATION = 10
 # Maximum duration for a long scan, before the scanner needs an "end_paper of paper"
@@ -34,6 +53,13 @@ SCAN_MAX_DURATION_LONG = 30
 MOTOR_WAKE_START_TIME = 1.4
 # Time after starting the scan, when to disable the motor
 MOTOR_SLEEP_START_TIME = SCAN_MAX_DURATION + 0.2
+# Maximum duration for a batch scan of a stack of sheets, usually ended by the user
+SCAN_MAX_DURATION_BATCH = 5 * 60
+# Delay between the sheets of a batch scan (ATFD, <=5)
+BATCH_FEED_DELAY = 1
+
+# Number of calls per function kept for the scheduler jitter
+JITTER_HISTORY = 100
 
 DPI = 100
 
@@ -49,96 +75,98 @@ class ScannerState(Enum):
     Paperjam = 20
 
 
-class Waiter:
-    def __init__(self):
-        self._t = threading.Thread(target=self._thread)
-        self._lock = threading.Lock()
-        self._e = threading.Condition(self._lock)
-        self._restart = threading.Condition(self._lock)
-        self._exit = False
-        self._f = None
-        self._to = 0
-        self._t.start()
+class RecoveryTier(Enum):
+    # ABT with eject on the protocol level
+    Abort = 1
+    # USB port reset and reopening the device
+    UsbReset = 2
+    # Cutting the power via GPIO and starting up again
+    PowerCycle = 3
 
-    def _thread(self):
-        while True:
-            with self._lock:
-                self._e.wait()
-                if self._exit:
-                    break
-                if self._restart.wait(self._to):
-                    if self._exit:
-                        break
-                    continue
-                f = self._f
-                self._f = None
-            f()
 
-    def delay(self, t: float, f: Callable[[], None]):
-        with self._lock:
-            assert self._f is None, "Can only handle one parallel delay"
-            self._to = t
-            self._f = f
-            self._e.notify()
+class ScheduledCall:
+    """Handle of a delayed call of a Scheduler."""
 
-    def stop(self):
-        with self._lock:
-            assert self._f is None, "Can only handle one parallel delay"
-            self._to = 0
-            self._f = None
-            self._restart.notify()
+    def __init__(self, deadline: float, f: Callable[[], None]):
+        self.deadline = deadline
+        self.f = f
+        self.cancelled = False
 
-    def shutdown(self):
-        if self._exit:
-            return
-        with self._lock:
-            self._exit = True
-            self._restart.notify()
-            self._e.notify()
-            self._t.join()
+    def __lt__(self, other: "ScheduledCall") -> bool:
+        return self.deadline < other.deadline
+
+    def cancel(self):
+        self.cancelled = True
 
 
-class Timer:
-    def __init__(self, f: Callable[[], None]):
-        self._t = threading.Thread(target=self._thread)
+class Scheduler:
+    """
+    Runs delayed calls on a single thread, ordered by their monotonic deadline.
+    Any number of calls may be pending, each can be cancelled by its handle.
+    """
+
+    def __init__(self):
+        self._heap: list[ScheduledCall] = []
         self._lock = threading.Lock()
-        self._e = threading.Condition(self._lock)
-        self._f = f
+        self._wakeup = threading.Condition(self._lock)
         self._exit = False
-        self._restart = threading.Condition(self._lock)
-        self._to = 0
+        # Latency of the last calls after their deadline, by function name
+        self.jitter: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=JITTER_HISTORY))
+        self._t = threading.Thread(target=self._thread, daemon=True)
         self._t.start()
 
     def _thread(self):
         while True:
             with self._lock:
-                self._e.wait()
+                while not self._exit:
+                    while self._heap and self._heap[0].cancelled:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._wakeup.wait()
+                        continue
+                    timeout = self._heap[0].deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._wakeup.wait(timeout)
                 if self._exit:
                     break
-                if self._restart.wait(self._to):
-                    if self._exit:
-                        break
-                    continue
-            self._f()
-
-    def start(self, t: float):
-        with self._lock:
-            self._to = t
-            self._restart.notify()
-            self._e.notify()
-
-    def stop(self):
+                call = heapq.heappop(self._heap)
+            self.jitter[call.f.__name__].append(time.monotonic() - call.deadline)
+            try:
+                call.f()
+            except Exception:
+                # Any failing call must not stop the later ones
+                traceback.print_exc()
+
+    def delay(self, t: float, f: Callable[[], None]) -> ScheduledCall:
+        """Calls f on the scheduler thread after t seconds."""
+        call = ScheduledCall(time.monotonic() + t, f)
         with self._lock:
-            self._restart.notify()
+            heapq.heappush(self._heap, call)
+            self._wakeup.notify()
+        return call
+
+    def print_jitter(self):
+        for name, lates in list(self.jitter.items()):
+            lates_ms = sorted(late * 1000 for late in lates)
+            print(
+                f"Jitter {name}: median {lates_ms[len(lates_ms) // 2]:.2f}ms, "
+                f"max {lates_ms[-1]:.2f}ms over {len(lates_ms)} calls"
+            )
 
     def shutdown(self):
-        if self._exit:
-            return
         with self._lock:
             self._exit = True
-            self._restart.notify()
-            self._e.notify()
-            self._t.join()
+            self._wakeup.notify()
+        self._t.join()
+
+
+@dataclass
+class ScanJob:
+    duration: float
+    batch: bool
+    future: Future = field(default_factory=Future)
+    submitted: float = field(default_factory=time.monotonic)
 
 
 def read_file_by_lines(f: int) -> Generator[bytes, None, None]:
@@ -167,6 +195,8 @@ def read_file_raw(f: int) -> bytes:
 
 class ScannerControl:
     _state: ScannerState = ScannerState.PowerDown
+    # Applies from the next start of the power saving timer
+    powersaving_timeout: float = POWERSAVING_TIMEOUT
 
     state_change: Callable[[ScannerState], None]
     # Scanner is ready to scan
@@ -180,9 +210,13 @@ class ScannerControl:
     scanner_running: Callable[[float], None]
     # Scanner is currently receiving the data
     scanner_receiving: Callable[[], None]
+    # Number of rows of the current page decoded so far
+    scanner_progress: Callable[[int], None]
+    # A page was scanned, called for every page as soon as it is received
+    scanner_page: Callable[[Image.Image], None]
     # One of the following three will end the scan:
-    # Result is the Image
-    scanner_success: Callable[[Image.Image], None]
+    # All pages were received
+    scanner_success: Callable[[], None]
     # Scanner has jammed :(
     scanner_jam: Callable[[], None]
     # Scanner has no paper (internal error!)
@@ -198,9 +232,22 @@ class ScannerControl:
         GPIO.output(PIN_BUTTON, False)
         GPIO.output(PIN_PAPER, False)
         GPIO.output(PIN_MOTOR_AWAKE, False)
-        self._waiter = Waiter()
-        self._waiter2 = Waiter()
-        self._sleep_timer = Timer(self._on_power_saving)
+        self._scheduler = Scheduler()
+        # Pending power saving timeout
+        self._sleep_call: ScheduledCall | None = None
+        # Pending calls of powering on, cancelled when powering off
+        self._power_calls: list[ScheduledCall] = []
+        self.recovery_durations: dict[RecoveryTier, list[float]] = {
+            tier: [] for tier in RecoveryTier
+        }
+        # Start time of a recovery by power cycle, finished when powered on
+        self._power_cycle_start: float | None = None
+        # Set to stop the running readiness poll
+        self._ready_cancel = threading.Event()
+        # Scans are run one after another by a single worker, None ends it
+        self._scan_jobs: queue.Queue[ScanJob | None] = queue.Queue()
+        self._scan_thread = threading.Thread(target=self._scan_worker, daemon=True)
+        self._scan_thread.start()
 
     def startup(self):
         """
@@ -217,6 +264,8 @@ class ScannerControl:
         elif self._state == ScannerState.PowerSaving:
             print(".startup() -> resume_from_powersaving")
             self._resume_from_powersaving()
+        elif self._state == ScannerState.StartingUp:
+            print(".startup() -> already starting up")
         else:
             print(".startup() -> noop")
             # It's already ready!
@@ -233,53 +282,147 @@ class ScannerControl:
 
     def end(self):
         print(".end()")
-        self._waiter.shutdown()
-        self._waiter2.shutdown()
-        self._sleep_timer.shutdown()
+        self._scan_jobs.put(None)
+        self._scan_thread.join()
+        self._scheduler.print_jitter()
+        self._scheduler.shutdown()
 
     def reset(self):
-        """Resets the scanner in case of error"""
-        self._power_off()
-        self._waiter.delay(RESTART_DELAY, self._power_on)
+        """
+        Resets the scanner in case of error (asynchronously).
+        Tries an abort with eject first, then a USB reset, and power cycles only as last resort.
+        """
+        print(".reset()")
+        if self._state == ScannerState.StartingUp:
+            print(".reset() -> already starting up")
+            return
+        self._set_state(ScannerState.StartingUp)
+        threading.Thread(target=self._recover).start()
+
+    def _recover(self):
+        for tier in RecoveryTier:
+            print(f"._recover() -> {tier.name}")
+            start = time.monotonic()
+            if tier == RecoveryTier.PowerCycle:
+                # Finished asynchronously in _on_powered_on
+                self._power_cycle_start = start
+                self._power_off()
+                self._power_calls.append(self._scheduler.delay(RESTART_DELAY, self._power_on))
+                return
+            try:
+                if tier == RecoveryTier.Abort:
+                    self._recover_abort()
+                else:
+                    self._recover_usb_reset()
+            except SCANNER_ERRORS:
+                traceback.print_exc()
+                print(f"Recovery {tier.name} failed after {time.monotonic() - start:.2f}s")
+                continue
+            self._recovered(tier, start)
+            self._start_sleep_timer()
+            self._set_state(ScannerState.Ready)
+            self.scanner_ready()
+            return
+
+    def _recover_abort(self):
+        assert self.drv is not None, "Driver not initialized"
+        self.drv.abort(eject=True)
+        assert self.drv.is_alive(), "Device not responding"
+        self.drv.invalidate_parameters()
+
+    def _recover_usb_reset(self):
+        assert self.drv is not None, "Driver not initialized"
+        self.drv.reset_usb()
+        self.drv.close()
+        self.drv = None
+        # The device enumerates again after the reset
+        deadline = time.monotonic() + USB_RESET_TIMEOUT
+        while True:
+            try:
+                self._open_driver()
+                return
+            except ValueError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def _recovered(self, tier: RecoveryTier, start: float):
+        durations = self.recovery_durations[tier]
+        durations.append(time.monotonic() - start)
+        print(
+            f"Recovered by {tier.name} in {durations[-1]:.2f}s "
+            f"(mean {sum(durations) / len(durations):.2f}s over {len(durations)})"
+        )
 
     def _set_state(self, state: ScannerState):
         print(f"._set_state({state!r})")
         self._state = state
         self.state_change(state)
 
+    def _start_sleep_timer(self):
+        self._stop_sleep_timer()
+        self._sleep_call = self._scheduler.delay(self.powersaving_timeout, self._on_power_saving)
+
+    def _stop_sleep_timer(self):
+        if self._sleep_call is not None:
+            self._sleep_call.cancel()
+            self._sleep_call = None
+
     def _on_power_saving(self):
         print("._on_power_saving()")
+        self._scheduler.print_jitter()
         self._set_state(ScannerState.PowerSaving)
         self.scanner_shutdown()
 
     def _on_powered_on(self, *_):
         print("._powered_on()")
-        self._sleep_timer.start(POWERSAVING_TIMEOUT)
+        self._start_sleep_timer()
         self._set_state(ScannerState.Ready)
         self.scanner_ready()
+        if self._power_cycle_start is not None:
+            self._recovered(RecoveryTier.PowerCycle, self._power_cycle_start)
+            self._power_cycle_start = None
+
+        if self.drv is not None and self.drv.is_alive():
+            # Opened by the readiness probe or resumed from power saving
+            print(f"Reusing USB driver (saves {self._drv_init_duration * 1000:.0f}ms)")
+            return
+        if self.drv is not None:
+            self.drv.close()
+            self.drv = None
+
+        self._open_driver()
 
+    def _open_driver(self):
         print("Initializing USB driver")
+        start = time.monotonic()
         if EMULATE_SCANNER:
             self.drv = DSDriverEmulator()
+        elif SCANNER_REPLAY:
+            self.drv = DSDriver(dev=SessionReplay(Path(SCANNER_REPLAY), loop=True))
         else:
             self.drv = DSDriver()
+        self._drv_init_duration = time.monotonic() - start
 
     def _power_on(self):
         print("._power_on()")
-        self._sleep_timer.stop()
+        self._stop_sleep_timer()
         GPIO.output(PIN_ONOFF, True)
         GPIO.output(PIN_MOTOR_AWAKE, True)
         self._set_state(ScannerState.StartingUp)
-        self._waiter.delay(STARTUP_DURATION, self._on_powered_on)
-        self._waiter2.delay(0.1, self._push_button)
+        self._wait_ready(STARTUP_DURATION)
+        self._power_calls.append(self._scheduler.delay(0.1, self._push_button))
 
     def _power_off(self):
         print("._power_off()")
-        self._sleep_timer.stop()
-        self._waiter.stop()
-        self._waiter2.stop()
+        self._stop_sleep_timer()
+        self._ready_cancel.set()
+        for call in self._power_calls:
+            call.cancel()
+        self._power_calls.clear()
 
         if self.drv is not None:
+            self.drv.cancel()
             self.drv.close()
             self.drv = None
 
@@ -300,91 +443,213 @@ class ScannerControl:
 
     def _resume_from_powersaving(self):
         print("._resume_from_powersaving()")
-        self._sleep_timer.stop()
+        self._stop_sleep_timer()
+        if self.drv is not None:
+            # The scanner lost the parameters while asleep, like after powering on
+            self.drv.invalidate_parameters()
         self._push_button()
-        self._waiter.delay(STARTUP_RESUME_DURATION, self._on_powered_on)
+        self._wait_ready(STARTUP_RESUME_DURATION)
+
+    def _wait_ready(self, max_duration: float):
+        """Calls _on_powered_on as soon as the scanner answers, at the latest after max_duration."""
+        self._ready_cancel.set()
+        self._ready_cancel = cancel = threading.Event()
+        start = time.monotonic()
+
+        def poll_ready():
+            if cancel.is_set():
+                return
+            dur = time.monotonic() - start
+            if self._probe_ready():
+                print(f"Ready after {dur:.2f}s (saves {max_duration - dur:.2f}s)")
+            elif dur >= max_duration:
+                print(f"Not answering after {dur:.2f}s, assuming ready")
+            else:
+                self._scheduler.delay(READY_POLL_INTERVAL, poll_ready)
+                return
+            if not cancel.is_set():
+                self._on_powered_on()
 
-    def scan(self, long: bool):
-        """Starts scanning"""
-        print(".scan()")
-        assert self.can_scan()
-        self._set_state(ScannerState.ScanStarting)
-        t = threading.Thread(
-            target=self._scan,
-            args=(SCAN_MAX_DURATION_LONG if long else SCAN_MAX_DURATION,),
+        self._scheduler.delay(READY_POLL_INTERVAL, poll_ready)
+
+    def _probe_ready(self) -> bool:
+        """Checks if the device enumerated and answers a command."""
+        try:
+            if self.drv is not None and not self.drv.is_alive():
+                self.drv.close()
+                self.drv = None
+            if self.drv is None:
+                self._open_driver()
+            assert self.drv is not None
+            # A replayed session only contains the recorded commands
+            return bool(SCANNER_REPLAY) or self.drv.probe()
+        except SCANNER_ERRORS as e:
+            print(f"Device not ready: {e!r}")
+            return False
+
+    def scan(self, long: bool, batch: bool = False) -> Future:
+        """
+        Starts scanning, or queues the scan after the running one.
+        In batch mode, a stack of sheets is scanned in one job until scan_stop(), every page is
+        passed to scanner_page as it completes.
+        The returned future resolves to the number of pages scanned.
+        """
+        print(f".scan(long={long}, batch={batch})")
+        assert self.can_scan() or self._state in (
+            ScannerState.ScanStarting,
+            ScannerState.ScanRunning,
+            ScannerState.ScanReceiving,
         )
-        t.start()
+        if self._state == ScannerState.Ready:
+            self._set_state(ScannerState.ScanStarting)
+        if batch:
+            duration = SCAN_MAX_DURATION_BATCH
+        elif long:
+            duration = SCAN_MAX_DURATION_LONG
+        else:
+            duration = SCAN_MAX_DURATION
+        job = ScanJob(duration, batch)
+        self._scan_jobs.put(job)
+        return job.future
+
+    def _scan_worker(self):
+        while (job := self._scan_jobs.get()) is not None:
+            if (
+                self._state == ScannerState.Paperjam
+                or not job.future.set_running_or_notify_cancel()
+            ):
+                print(f"Dropping queued scan {job}")
+                job.future.cancel()
+                continue
+            print(f"Scan started {(time.monotonic() - job.submitted) * 1000:.1f}ms after submit")
+            try:
+                job.future.set_result(self._scan(job.duration, job.batch))
+            except Exception as e:
+                # Also errors of the callbacks, the worker must keep running for the queued scans
+                traceback.print_exc()
+                job.future.set_exception(e)
+                if not isinstance(e, SCANNER_ERRORS):
+                    # Not a scanner failure (no jam), it can scan again
+                    self._set_state(ScannerState.Ready)
 
     def scan_stop(self):
         """Stop scanning"""
         print(".scan_stop()")
         GPIO.output(PIN_PAPER, False)
 
+    def scan_abort(self):
+        """Abort scanning immediately (from any thread), received data is discarded."""
+        print(".scan_abort()")
+        GPIO.output(PIN_PAPER, False)
+        if self.drv is not None:
+            self.drv.cancel()
+
     drv: DSDriver | DSDriverEmulator | None = None
+    # Duration of opening the USB driver, saved when it is reused
+    _drv_init_duration: float = 0
 
-    def _scan(self, duration: float = SCAN_MAX_DURATION):
+    def _scan(self, duration: float = SCAN_MAX_DURATION, batch: bool = False) -> int:
         print("._scan()")
         assert self.drv is not None, "Driver not initialized"
+        self._set_state(ScannerState.ScanStarting)
         self.scanner_starting()
         start = time.time()
         # GPIO.output(PIN_MOTOR_AWAKE, False)
 
-        t_barrier = threading.Barrier(2)
-        t_abort = threading.Event()
+        # Ended by the scheduler after the duration, or earlier from the scan
+        end_lock = threading.Lock()
+        paper_ended = threading.Event()
 
-        def end_paper():
+        def end_paper(receiving: bool = True):
             nonlocal start
-            # Synchronize the start
-            t_barrier.wait()
-            t_abort.wait(duration)
+            with end_lock:
+                if paper_ended.is_set():
+                    return
+                paper_ended.set()
+            end_call.cancel()
             GPIO.output(PIN_PAPER, False)
             print(f"Paper=False after {time.time() - start}sec")
             start = time.time()
 
-            self._set_state(ScannerState.ScanReceiving)
-            self.scanner_receiving()
-
-        t_end_paper = threading.Thread(target=end_paper)
-
-        t_end_paper.start()
-        print("Threads started")
+            # Not after a failure, the jam state must stay
+            if receiving:
+                self._set_state(ScannerState.ScanReceiving)
+                self.scanner_receiving()
 
         print("Setting paper=True")
         GPIO.output(PIN_PAPER, True)
         time.sleep(0.5)
-
-        # Ensure thread is started
-        print("Sync")
-        t_barrier.wait()
+        end_call = self._scheduler.delay(duration, end_paper)
 
         try:
-            if duration > SCAN_MAX_DURATION:
-                long = "ON"
+            if batch:
+                # Fixed page length, so each page is passed on while the stack is still feeding
+                req = SSPRequest(
+                    RESO=(150, 150), LONG="OFF", AREA="OVER", ATCN="ON", ATFD=BATCH_FEED_DELAY
+                )
+            elif duration > SCAN_MAX_DURATION:
+                req = SSPRequest(RESO=(150, 150), LONG="ON", AREA="OVER")
             else:
-                long = "OFF"
-            self.drv.set_parameters(SSPRequest(RESO=(150, 150), LONG=long, AREA="OVER"))
+                req = SSPRequest(RESO=(150, 150), LONG="OFF", AREA="OVER")
+            self.drv.set_parameters(req)
             self.scanner_running(duration)
-            page = None
-            for page in self.drv.scan(
+            # In batch mode, the paper line stays up until the stack is done
+            end_detector = None if batch else PageEndDetector()
+            pages = 0
+            for band in self.drv.scan_progressive(
                 XSCRequest(
                     RESO=(150, 150),
                     AREA=(0, 0, 1294, 1650),
                 )
             ):
-                pass
+                if band.final:
+                    pages += 1
+                    self.scanner_page(band.image)
+                    continue
+                self.scanner_progress(band.bottom)
+                if (
+                    end_detector is not None
+                    and not paper_ended.is_set()
+                    and end_detector.feed(band.band())
+                ):
+                    print(f"Sheet passed at row {band.bottom}, ending paper")
+                    end_paper()
             print(f"Done after {time.time() - start}s")
+        except SCANNER_ERRORS:
+            traceback.print_exc()
+            end_paper(receiving=False)
+            self._set_state(ScannerState.Paperjam)
+            self.scanner_jam()
+            raise
         finally:
             # Finish everything
-            t_abort.set()
-            t_end_paper.join()
+            end_paper()
             GPIO.output(PIN_PAPER, False)
 
         print(f"Duration: {time.time() - start}sec")
         self._set_state(ScannerState.Ready)
-        if page is not None:
-            self.scanner_success(page)
+        if pages > 0:
+            self.scanner_success()
         else:
             self.scanner_no_paper()
+        return pages
+
+
+def dbg_scheduler_jitter(n: int = 200):
+    """Measures the latency of many overlapping delays, some of them cancelled."""
+    scheduler = Scheduler()
+    done = threading.Event()
+
+    def gpio_action():
+        pass
+
+    calls = [scheduler.delay(0.001 * (i % 50), gpio_action) for i in range(n)]
+    for call in calls[::3]:
+        call.cancel()
+    scheduler.delay(0.1, done.set)
+    done.wait()
+    scheduler.print_jitter()
+    scheduler.shutdown()
 
 
 if __name__ == "__main__":
@@ -397,7 +662,6 @@ if __name__ == "__main__":
         global n
         img.save(f"last_{n}.jpg", quality=90)
         n += 1
-        e.set()
 
     sc.state_change = lambda state: print(f"State: {state}")
     sc.scanner_ready = lambda: e.set()
@@ -405,7 +669,9 @@ if __name__ == "__main__":
     sc.scanner_starting = lambda: None
     sc.scanner_running = lambda t: None
     sc.scanner_receiving = lambda: None
-    sc.scanner_success = save
+    sc.scanner_progress = lambda rows: None
+    sc.scanner_page = save
+    sc.scanner_success = lambda: e.set()
     sc.scanner_jam = lambda: e.set()
     sc.scanner_no_paper = lambda: e.set()
     sc.startup()
@@ -0,0 +1,216 @@
+import itertools
+import multiprocessing
+import threading
+import traceback
+from collections.abc import Callable
+from concurrent.futures import Future
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+
+from PIL import Image
+
+from scanapp.ds_driver import SCANNER_ERRORS
+from scanapp.scanner_control import POWERSAVING_TIMEOUT, ScannerControl, ScannerState
+
+# Rows of a page copied to shared memory at once
+SHM_BAND_ROWS = 64
+
+# Callbacks of ScannerControl, which are forwarded as is (i.e. with small arguments)
+FORWARDED_CALLBACKS = (
+    "state_change",
+    "scanner_ready",
+    "scanner_shutdown",
+    "scanner_starting",
+    "scanner_running",
+    "scanner_receiving",
+    "scanner_progress",
+    "scanner_success",
+    "scanner_jam",
+    "scanner_no_paper",
+)
+
+
+def _child_main(conn: Connection):
+    """Runs the ScannerControl in the child process, commands in and events out over conn."""
+    send_lock = threading.Lock()
+
+    def send(*msg):
+        with send_lock:
+            conn.send(msg)
+
+    def forward(name: str):
+        return lambda *args: send("cb", name, args)
+
+    def send_page(img: Image.Image):
+        # The pixels go through shared memory, which the parent unlinks after copying
+        row_size = img.width * len(img.getbands())
+        size = row_size * img.height
+        shm = SharedMemory(create=True, size=max(size, 1))
+        # Written in bands, without a temporary copy of the whole page
+        for top in range(0, img.height, SHM_BAND_ROWS):
+            bottom = min(top + SHM_BAND_ROWS, img.height)
+            shm.buf[top * row_size : bottom * row_size] = img.crop(
+                (0, top, img.width, bottom)
+            ).tobytes()
+        send("page", shm.name, img.mode, img.size, size)
+        shm.close()
+
+    def send_result(job_id: int, future: Future):
+        if future.cancelled():
+            send("scan_result", job_id, None, "cancelled")
+        elif future.exception() is not None:
+            send("scan_result", job_id, None, repr(future.exception()))
+        else:
+            send("scan_result", job_id, future.result(), None)
+
+    ctrl = ScannerControl()
+    for name in FORWARDED_CALLBACKS:
+        setattr(ctrl, name, forward(name))
+    ctrl.scanner_page = send_page
+
+    while True:
+        cmd, *args = conn.recv()
+        if cmd == "end":
+            break
+        if cmd == "scan":
+            job_id, long, batch = args
+            try:
+                future = ctrl.scan(long, batch)
+            except SCANNER_ERRORS as e:
+                # E.g. not ready, the future of the parent fails right away
+                send("scan_result", job_id, None, repr(e))
+            else:
+                future.add_done_callback(lambda future, job_id=job_id: send_result(job_id, future))
+            continue
+        try:
+            if cmd == "powersaving_timeout":
+                (ctrl.powersaving_timeout,) = args
+            else:
+                getattr(ctrl, cmd)(*args)
+        except SCANNER_ERRORS:
+            traceback.print_exc()
+    ctrl.end()
+    send("ended")
+
+
+class ScannerProcess:
+    """
+    Runs the ScannerControl (and thus the USB driver) in a child process, with the same interface.
+    Callbacks are called on an event thread of this process, pages are passed via shared memory.
+    """
+
+    state_change: Callable[[ScannerState], None]
+    scanner_ready: Callable[[], None]
+    scanner_shutdown: Callable[[], None]
+    scanner_starting: Callable[[], None]
+    scanner_running: Callable[[float], None]
+    scanner_receiving: Callable[[], None]
+    scanner_progress: Callable[[int], None]
+    scanner_page: Callable[[Image.Image], None]
+    scanner_success: Callable[[], None]
+    scanner_jam: Callable[[], None]
+    scanner_no_paper: Callable[[], None]
+
+    _state: ScannerState = ScannerState.PowerDown
+    _powersaving_timeout: float = POWERSAVING_TIMEOUT
+
+    def __init__(self):
+        # Spawn, as forking the threads of Qt and pyusb is not safe
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+        self._send_lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._jobs: dict[int, Future] = {}
+        self._process = ctx.Process(target=_child_main, args=(child_conn,), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._events = threading.Thread(target=self._event_thread, daemon=True)
+        self._events.start()
+
+    def _send(self, *msg):
+        with self._send_lock:
+            self._conn.send(msg)
+
+    def _event_thread(self):
+        while True:
+            try:
+                event, *args = self._conn.recv()
+            except EOFError:
+                print("Scanner process exited")
+                break
+            if event == "ended":
+                break
+            try:
+                if event == "cb":
+                    name, cb_args = args
+                    if name == "state_change":
+                        (self._state,) = cb_args
+                    getattr(self, name)(*cb_args)
+                elif event == "page":
+                    self.scanner_page(self._receive_page(*args))
+                elif event == "scan_result":
+                    job_id, pages, error = args
+                    future = self._jobs.pop(job_id)
+                    if error is None:
+                        future.set_result(pages)
+                    else:
+                        future.set_exception(
+                            RuntimeError(f"Scan failed in scanner process: {error}")
+                        )
+            # An unknown job or a failing callback must not end the event thread
+            except (KeyError, TypeError, *SCANNER_ERRORS):
+                traceback.print_exc()
+
+    def _receive_page(
+        self, name: str, mode: str, size: tuple[int, int], nbytes: int
+    ) -> Image.Image:
+        shm = SharedMemory(name=name)
+        try:
+            view = shm.buf[:nbytes]
+            img = Image.frombytes(mode, size, view)
+            view.release()
+        finally:
+            shm.close()
+            shm.unlink()
+        return img
+
+    def startup(self):
+        self._send("startup")
+
+    def can_scan(self) -> bool:
+        """Ensures that the scanner is ready and can scan now."""
+        return self._state == ScannerState.Ready
+
+    def shutdown(self):
+        """Shuts down the scanner (asynchronously)."""
+        self._send("shutdown")
+
+    def reset(self):
+        self._send("reset")
+
+    @property
+    def powersaving_timeout(self) -> float:
+        return self._powersaving_timeout
+
+    @powersaving_timeout.setter
+    def powersaving_timeout(self, timeout: float):
+        self._powersaving_timeout = timeout
+        self._send("powersaving_timeout", timeout)
+
+    def scan(self, long: bool, batch: bool = False) -> Future:
+        job_id = next(self._job_ids)
+        future = Future()
+        self._jobs[job_id] = future
+        self._send("scan", job_id, long, batch)
+        return future
+
+    def scan_stop(self):
+        self._send("scan_stop")
+
+    def scan_abort(self):
+        self._send("scan_abort")
+
+    def end(self):
+        self._send("end")
+        self._events.join()
+        self._process.join()
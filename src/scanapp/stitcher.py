@@ -3,12 +3,25 @@ try:
 except ImportError:
     QImage = None
 import io
+import shutil
+import time
+import tracemalloc
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+from typing import ClassVar, TypeVar
 
 import numpy as np
 from PIL import Image, ImageChops, ImageOps
 
+from scanapp.ds_driver import RawPage
+from scanapp.env import SCAN_WORKERS
+from scanapp.page_encoder import encode_page
+from scanapp.page_store import PageStore
+
+T = TypeVar("T")
+
 
 @dataclass
 class Cropbox:
@@ -48,54 +61,205 @@ class Cropbox:
         )
 
 
+# Difference to the background (grayscale) of a pixel to count as paper
+BG_THRESHOLD = 28
+
+
+def paper_mask(pixels: np.ndarray, bg: np.ndarray, threshold: int = BG_THRESHOLD) -> np.ndarray:
+    """
+    Marks the pixels [h, w, 3] which differ from the background row [w, 3].
+    Computes the grayscale of the difference like PIL does.
+    """
+    diff = np.abs(pixels.astype(np.int32) - bg)
+    gray = (diff[..., 0] * 19595 + diff[..., 1] * 38470 + diff[..., 2] * 7471 + 0x8000) >> 16
+    return gray >= threshold
+
+
+class PageEndDetector:
+    """Detects from the rows received so far, when the sheet has passed the scanner."""
+
+    # Number of pixels in a row which must differ to count the row as paper (ignores dust)
+    MIN_PIXELS = 8
+    # Number of background rows after the sheet until it is considered passed (0.2in at 150dpi)
+    END_ROWS = 30
+
+    def __init__(self):
+        self._bg = np.asarray(ScanCollector.CALIBRATION_BG, dtype=np.int32)[0]
+        self.reset()
+
+    def reset(self):
+        self.paper_seen = False
+        self.empty_rows = 0
+
+    def feed(self, band: Image.Image) -> bool:
+        """Checks the next rows of the page, returns if the sheet has passed."""
+        assert band.width == self._bg.shape[0], "Calibration does not match the scanned size"
+        mask = paper_mask(np.asarray(band), self._bg)
+        paper_rows = np.flatnonzero(np.count_nonzero(mask, axis=1) >= self.MIN_PIXELS)
+        if len(paper_rows) > 0:
+            self.paper_seen = True
+            self.empty_rows = band.height - 1 - int(paper_rows[-1])
+        elif self.paper_seen:
+            self.empty_rows += band.height
+        return self.paper_seen and self.empty_rows >= self.END_ROWS
+
+
+@dataclass
+class Strip:
+    img: Image.Image
+    # Position of the strip in the current image
+    offset: tuple[int, int]
+
+
+def composite(strips: list[Strip], box: tuple[int, int, int, int]) -> Image.Image:
+    """Composites the box region of the strips onto white, only the overlapping strips are pasted."""
+    img = Image.new("RGB", (box[2] - box[0], box[3] - box[1]), "white")
+    for strip in strips:
+        if strip.offset[1] < box[3] and strip.offset[1] + strip.img.height > box[1]:
+            img.paste(strip.img, (strip.offset[0] - box[0], strip.offset[1] - box[1]))
+    return img
+
+
 class ScanCollector:
     MAX_HEIGHT = 8000
     PREVIEW_MARGIN = 3
+    # Stride of the coarse pass of the cropbox, refined at full resolution near the edges
+    CROPBOX_STRIDE = 4
+    # Number of rows calibrated at once, limits the temporary index array
+    CALIBRATION_BAND_ROWS = 256
+    # Number of coarse rows checked at once for the cropbox
+    CROPBOX_BAND_ROWS = 64
 
     CALIBRATION_BG = Image.open(Path(__file__).parent / "calibration150_bg.png")
     CALIBRATION_WHITE = Image.open(Path(__file__).parent / "calibration150_white.png")
     CALIBRATION_GRAY = Image.open(Path(__file__).parent / "calibration150_gray.png")
 
-    cur_img: Image.Image | None
+    # Calibrated strips of the current image, composited when finalized
+    cur_strips: list[Strip]
     cur_cropbox: Cropbox
-    imgs: list[bytes]
+    # Strips reduced by the preview factor, positioned in scan columns (not shifted when extending)
+    cur_preview_strips: list[Strip]
+    # Finalized pages, spilled to files
+    pages: PageStore
     preview_imgs: list[Image.Image]
 
     thumbnail_size: tuple[int, int]
     cur_thumbnail: Image.Image | None = None
+    cur_img_thumbnail: Image.Image | None = None
     cur_thumbnail_x: int = 0
     cur_thumbnail_width: int = 0
 
-    def __init__(self, thumbnail_size: tuple[int, int]):
-        self.cur_img = None
-        self.imgs = []
+    # Background row per image width, the rows of the image are compared to it
+    _bg_rows: ClassVar[dict[int, np.ndarray]] = {}
+    # Calibrated value per column, channel and input value [w * 3 * 256], built on first use
+    _calibration_lut: ClassVar[np.ndarray | None] = None
+    # Thread pools for the bands of a page by number of workers, shared by all collectors
+    _band_pools: ClassVar[dict[int, ThreadPoolExecutor]] = {}
+    # Thread pools for encoding the finalized images by number of workers
+    _encode_pools: ClassVar[dict[int, ThreadPoolExecutor]] = {}
+
+    def __init__(self, thumbnail_size: tuple[int, int], workers: int = SCAN_WORKERS):
+        self.cur_strips = []
+        self.cur_preview_strips = []
+        self.pages = PageStore()
+        # Encodes of finalized images, which may still be running
+        self._encodes: list[Future] = []
         self.preview_imgs = []
         self.thumbnail_size = thumbnail_size
+        # Integer reduction of the current image, such that it still covers the thumbnail width
+        self.preview_factor = 1
+        self.workers = workers
+
+    def _map_bands(self, fn: Callable[[int, int], T], height: int, rows: int) -> list[T]:
+        """Runs fn(top, bottom) for horizontal bands of the page, in parallel with workers."""
+        bands = [(top, min(top + rows, height)) for top in range(0, height, rows)]
+        if self.workers <= 1 or len(bands) <= 1:
+            return [fn(top, bottom) for top, bottom in bands]
+        pool = self._band_pools.get(self.workers)
+        if pool is None:
+            pool = self._band_pools[self.workers] = ThreadPoolExecutor(self.workers)
+        # NumPy releases the GIL for the bulk of the work
+        return list(pool.map(lambda band: fn(*band), bands))
 
     def can_continue(self) -> bool:
-        return self.cur_img is not None
+        return len(self.cur_strips) > 0
 
     def begin_next(self):
-        if self.cur_img is not None:
+        if self.cur_strips:
             self._finalize_current()
-        self.cur_img = None
 
-    def get_all(self) -> list[bytes]:
-        if self.cur_img is not None:
+    def get_all(self) -> PageStore:
+        if self.cur_strips:
             self._finalize_current()
-        return self.imgs
+        # Only waits for the encodes still in flight, raises their errors
+        for future in self._encodes:
+            future.result()
+        self._encodes = []
+        return self.pages
+
+    def cur_image(self, box: tuple[int, int, int, int] | None = None) -> Image.Image:
+        """Composites the current image from its strips, or only the box region of it."""
+        if box is None:
+            box = (0, 0, self.cur_cropbox.width, self.cur_cropbox.height)
+        return composite(self.cur_strips, box)
+
+    def cur_preview(self, top: int, bottom: int) -> Image.Image:
+        """Composites the rows top to bottom (in preview rows) of the reduced current image."""
+        f = self.preview_factor
+        return composite(
+            self.cur_preview_strips,
+            (self.cur_cropbox.left // f, top, -(-self.cur_cropbox.right // f), bottom),
+        )
+
+    def _bg_row(self, width: int) -> np.ndarray:
+        bg = self._bg_rows.get(width)
+        if bg is None:
+            bg = np.asarray(
+                self.CALIBRATION_BG.resize((width, 1), resample=Image.Resampling.NEAREST),
+                dtype=np.int32,
+            )[0]
+            self._bg_rows[width] = bg
+        return bg
+
+    def _paper_mask(self, img: Image.Image, bg: np.ndarray, box: tuple[int, int, int, int]):
+        """The paper mask of a region (left, top, right, bottom) of the image."""
+        return paper_mask(np.asarray(img.crop(box)), bg[box[0] : box[2]])
 
     def _cropbox(self, img: Image.Image) -> Cropbox | None:
-        calib = self.CALIBRATION_BG.resize(img.size, resample=Image.Resampling.NEAREST)
-        print(calib, img)
-        diff = ImageChops.difference(img, calib)
-        del calib
-        diff = ImageOps.grayscale(diff)
-        diff = Image.eval(diff, lambda c: 0 if c < 28 else 255)
-        diffbox = diff.getbbox()
-        if not diffbox:
+        bg = self._bg_row(img.width)
+        s = self.CROPBOX_STRIDE
+        # Every s-th pixel of every s-th row, starting at 0
+        coarse_img = img.transform(
+            (-(-img.width // s), -(-img.height // s)),
+            Image.Transform.AFFINE,
+            (s, 0, -(s // 2), 0, s, -(s // 2)),
+            Image.Resampling.NEAREST,
+        )
+        coarse_px = np.asarray(coarse_img)
+
+        def _coarse_band(top: int, bottom: int) -> tuple[np.ndarray, np.ndarray]:
+            mask = paper_mask(coarse_px[top:bottom], bg[::s])
+            return mask.any(axis=1), mask.any(axis=0)
+
+        bands = self._map_bands(_coarse_band, coarse_px.shape[0], self.CROPBOX_BAND_ROWS)
+        rows = np.flatnonzero(np.concatenate([band_rows for band_rows, _ in bands])).tolist()
+        if len(rows) == 0:
             return None
-        return Cropbox(*diffbox)
+        cols = np.flatnonzero(np.logical_or.reduce([band_cols for _, band_cols in bands])).tolist()
+        # Each edge lies between the last sample without paper and the first sample with paper
+        lo = max(0, (rows[0] - 1) * s + 1)
+        found = self._paper_mask(img, bg, (0, lo, img.width, rows[0] * s + 1)).any(axis=1)
+        top = lo + int(found.argmax())
+        lo = rows[-1] * s
+        found = self._paper_mask(img, bg, (0, lo, img.width, min(img.height, lo + s))).any(axis=1)
+        bottom = lo + len(found) - int(found[::-1].argmax())
+        lo = max(0, (cols[0] - 1) * s + 1)
+        found = self._paper_mask(img, bg, (lo, top, cols[0] * s + 1, bottom)).any(axis=0)
+        left = lo + int(found.argmax())
+        lo = cols[-1] * s
+        found = self._paper_mask(img, bg, (lo, top, min(img.width, lo + s), bottom)).any(axis=0)
+        right = lo + len(found) - int(found[::-1].argmax())
+        return Cropbox(left, top, right, bottom)
 
     # def _cropbox(self, img: Image.Image) -> Cropbox:
     #     # Compute the diff mask
@@ -113,24 +277,36 @@ class ScanCollector:
     #     # Get tight box
     #     return Cropbox(left, top, right, bottom)
 
+    @classmethod
+    def _calibration_table(cls) -> np.ndarray:
+        if cls._calibration_lut is None:
+            white = np.asarray(cls.CALIBRATION_WHITE, dtype=np.float32)[0, :, :, None]
+            gray = np.asarray(cls.CALIBRATION_GRAY, dtype=np.float32)[0, :, :, None]
+            black = white - (white - gray) * 1.5
+            values = np.arange(256, dtype=np.float32)
+            lut = (values - black) / (np.maximum(white - black, 1e-3) / 255)
+            cls._calibration_lut = lut.clip(0, 255).astype(np.uint8).reshape(-1)
+        return cls._calibration_lut
+
     def apply_calibration(self, img: Image.Image, crop: tuple[int, int]) -> Image.Image:
-        img = np.asarray(img, dtype=np.float16)
-        white = np.asarray(self.CALIBRATION_WHITE.crop((crop[0], 0, crop[1], 1)), dtype=np.float16)
-        gray = np.asarray(self.CALIBRATION_GRAY.crop((crop[0], 0, crop[1], 1)), dtype=np.float16)
-        black = white - (white - gray) * 1.5
-        res = (img - black) / ((white - black) / 255)
-        # white = self.CALIBRATION_WHITE.crop((crop[0], 0, crop[2], 1))
-        # white = white.resize(img.size)
-        # diff = ImageChops.subtract(white - img)
-        # gray = self.CALIBRATION_GRAY.crop((crop[0], 0, crop[2], 1))
-        # gray = gray.resize(img.size)
-        # relative_gray = ImageChops.subtract(gray - white)
-        # (MAX - (white - img)) * ((MAX - (white - gray)) / MAX / 0.8)
-        return Image.fromarray(res.clip(0, 255).astype(np.uint8), mode="RGB")
+        lut = self._calibration_table()
+        # Copy, which is calibrated in place
+        px = np.array(img)
+        # Offset of each column and channel into the table
+        offsets = (np.arange(crop[0] * 3, crop[1] * 3, dtype=np.int32) * 256).reshape(-1, 3)
+
+        def _calibrate_band(top: int, bottom: int):
+            band = px[top:bottom]
+            np.take(lut, offsets + band, out=band, mode="clip")
 
-    def append(self, img_data: bytes | Image.Image):
+        self._map_bands(_calibrate_band, px.shape[0], self.CALIBRATION_BAND_ROWS)
+        return Image.fromarray(px, mode="RGB")
+
+    def append(self, img_data: bytes | RawPage | Image.Image):
         if isinstance(img_data, bytes):
             img = Image.open(io.BytesIO(img_data))
+        elif isinstance(img_data, RawPage):
+            img = img_data.image()
         else:
             assert isinstance(img_data, Image.Image)
             img = img_data
@@ -141,21 +317,25 @@ class ScanCollector:
         assert img.width == self.CALIBRATION_BG.width, "Calibration does not match the scanned size"
         img = img.crop((cropbox.left, cropbox.top, cropbox.right, cropbox.bottom))
         img = self.apply_calibration(img, (cropbox.left, cropbox.right))
-        if self.cur_img is None:
+        if not self.cur_strips:
             # New image
             print(f"New scan cropbox={cropbox} (w={cropbox.width}, h={cropbox.height})")
-            self.cur_img = img
+            self.cur_strips = [Strip(img, (0, 0))]
+            self.cur_preview_strips = []
             self.cur_cropbox = cropbox
+            self.preview_factor = max(1, cropbox.width // self.thumbnail_size[0])
             self.cur_thumbnail_x += self.cur_thumbnail_width
             self.cur_thumbnail_width = 0
-        elif self.cur_img.height + cropbox.height > self.MAX_HEIGHT or cropbox.top > 10:
+        elif self.cur_cropbox.height + cropbox.height > self.MAX_HEIGHT or cropbox.top > 10:
             print(
                 f"Has space, start new scan cropbox={cropbox} (w={cropbox.width}, h={cropbox.height})"
             )
             # Image too large; or not continuing, start new
             self._finalize_current()
-            self.cur_img = img
+            self.cur_strips = [Strip(img, (0, 0))]
+            self.cur_preview_strips = []
             self.cur_cropbox = cropbox
+            self.preview_factor = max(1, cropbox.width // self.thumbnail_size[0])
             self.cur_thumbnail_x += self.cur_thumbnail_width
             self.cur_thumbnail_width = 0
         else:
@@ -165,18 +345,30 @@ class ScanCollector:
             print(
                 f"New box: new_cropbox={new_cropbox} (w={new_cropbox.width}, h={new_cropbox.height}), cur_offset={cur_offset}, offset={offset}"
             )
-            img_new = Image.new("RGB", (new_cropbox.width, new_cropbox.height), "white")
-            img_new.paste(self.cur_img, cur_offset)
-            img_new.paste(img, offset)
-            self.cur_img = img_new
+            # Only the offsets move, the pixels are composited when finalizing
+            if cur_offset != (0, 0):
+                for strip in self.cur_strips:
+                    strip.offset = (
+                        strip.offset[0] + cur_offset[0],
+                        strip.offset[1] + cur_offset[1],
+                    )
+            self.cur_strips.append(Strip(img, offset))
             self.cur_cropbox = new_cropbox
-        if (
-            self.thumbnail_size[1] / self.thumbnail_size[0]
-            >= self.cur_img.height / self.cur_img.width
-        ):
+        # Only the new strip is reduced, the thumbnail is built from the reduced strips
+        f = self.preview_factor
+        self.cur_preview_strips.append(
+            Strip(
+                img.reduce(f) if f > 1 else img,
+                (cropbox.left // f, self.cur_strips[-1].offset[1] // f),
+            )
+        )
+        cur_width = self.cur_cropbox.width
+        cur_height = self.cur_cropbox.height
+        preview_height = -(-cur_height // f)
+        if self.thumbnail_size[1] / self.thumbnail_size[0] >= cur_height / cur_width:
             print("Simple Thumbnail")
             # Limited by width
-            th = self.cur_img.copy()
+            th = self.cur_preview(0, preview_height)
             th.thumbnail(self.thumbnail_size)
             self.cur_img_thumbnail = th
         else:
@@ -185,22 +377,20 @@ class ScanCollector:
             th_tb = (self.thumbnail_size[1] - self.PREVIEW_MARGIN) // 2
             th_bt = (self.thumbnail_size[1] + self.PREVIEW_MARGIN) // 2
             th_bt_size = self.thumbnail_size[1] - th_bt
-            img_tb = th_tb * self.cur_img.width // self.thumbnail_size[0]
-            img_bt_size = th_bt_size * self.cur_img.width // self.thumbnail_size[0]
-            img_bt = self.cur_img.height - img_bt_size
+            # In preview rows
+            img_tb = th_tb * cur_width // self.thumbnail_size[0] // f
+            img_bt_size = th_bt_size * cur_width // self.thumbnail_size[0] // f
+            img_bt = preview_height - img_bt_size
+            # Only the shown regions are composited
             self.cur_img_thumbnail.paste(
-                self.cur_img.resize(
-                    (self.thumbnail_size[0], th_tb),
-                    resample=Image.Resampling.BOX,
-                    box=(0, 0, self.cur_img.width, img_tb),
+                self.cur_preview(0, img_tb).resize(
+                    (self.thumbnail_size[0], th_tb), resample=Image.Resampling.BOX
                 ),
                 box=(0, 0),
             )
             self.cur_img_thumbnail.paste(
-                self.cur_img.resize(
-                    (self.thumbnail_size[0], th_bt_size),
-                    resample=Image.Resampling.BOX,
-                    box=(0, img_bt, self.cur_img.width, self.cur_img.height),
+                self.cur_preview(img_bt, preview_height).resize(
+                    (self.thumbnail_size[0], th_bt_size), resample=Image.Resampling.BOX
                 ),
                 box=(0, th_bt),
             )
@@ -208,13 +398,25 @@ class ScanCollector:
             # There is empty space at the end, disconnect from next scan
             self._finalize_current()
 
-    def _finalize_current(self):
+    def _finalize_current(self) -> Future:
         print("Finish current image")
-        assert self.cur_img is not None
-        dst = io.BytesIO()
-        self.cur_img.save(dst, format="jpeg")
-        self.cur_img = None
-        self.imgs.append(dst.getvalue())
+        assert self.cur_strips
+        # The page is reserved now to keep the order, and written when encoded
+        img = self.cur_image()
+        path = self.pages.add()
+        pool = self._encode_pools.get(self.workers)
+        if pool is None:
+            pool = self._encode_pools[self.workers] = ThreadPoolExecutor(self.workers)
+        # PIL releases the GIL while encoding
+        future = pool.submit(self._encode, img, path)
+        self._encodes.append(future)
+        self.cur_strips = []
+        self.cur_preview_strips = []
+        return future
+
+    def _encode(self, img: Image.Image, path: Path):
+        # Format and quality are chosen for the byte budget of the page
+        self.pages.written(path, encode_page(img, path))
 
     def qthumbnail(self) -> QImage:
         data = self.cur_img_thumbnail.tobytes("raw", "RGB")
@@ -269,6 +471,137 @@ class ScanCollector:
 #         return dst.getvalue()
 
 
+def dbg_cropbox_bench(path: Path = Path(__file__).parent / "testscan.jpg", runs: int = 10):
+    """Compares the cropbox with the former full resolution PIL implementation."""
+    scan = Image.open(path).convert("RGB")
+    # A4 at 150dpi, and a long receipt of two scans
+    a4 = scan.crop((0, 0, scan.width, 1754))
+    receipt = Image.new("RGB", (scan.width, scan.height * 2))
+    receipt.paste(scan, (0, 0))
+    receipt.paste(scan, (0, scan.height))
+
+    def _cropbox_pil(img: Image.Image) -> Cropbox | None:
+        calib = ScanCollector.CALIBRATION_BG.resize(img.size, resample=Image.Resampling.NEAREST)
+        diff = ImageChops.difference(img, calib)
+        diff = ImageOps.grayscale(diff)
+        diff = Image.eval(diff, lambda c: 0 if c < BG_THRESHOLD else 255)
+        diffbox = diff.getbbox()
+        return Cropbox(*diffbox) if diffbox else None
+
+    sc = ScanCollector((100, 100))
+    for name, img in (("a4", a4), ("receipt", receipt)):
+        res = []
+        for fn in (_cropbox_pil, sc._cropbox):
+            box = fn(img)
+            start = time.perf_counter()
+            for _ in range(runs):
+                fn(img)
+            res.append(((time.perf_counter() - start) / runs, box))
+        (dur_pil, box_pil), (dur_np, box_np) = res
+        print(
+            f"{name} {img.size}: pil {dur_pil * 1000:.1f}ms, numpy {dur_np * 1000:.1f}ms "
+            f"({dur_pil / dur_np:.1f}x), {box_np}{'' if box_np == box_pil else f' != {box_pil}'}"
+        )
+
+
+def dbg_calibration_bench(path: Path = Path(__file__).parent / "testscan.jpg", runs: int = 10):
+    """Compares the calibration lookup with the former float16 implementation."""
+    scan = Image.open(path).convert("RGB")
+    sc = ScanCollector((100, 100))
+    cropbox = sc._cropbox(scan)
+    img = scan.crop((cropbox.left, cropbox.top, cropbox.right, cropbox.bottom))
+    crop = (cropbox.left, cropbox.right)
+
+    def _apply_calibration_float16(img: Image.Image, crop: tuple[int, int]) -> Image.Image:
+        img = np.asarray(img, dtype=np.float16)
+        white = np.asarray(sc.CALIBRATION_WHITE.crop((crop[0], 0, crop[1], 1)), dtype=np.float16)
+        gray = np.asarray(sc.CALIBRATION_GRAY.crop((crop[0], 0, crop[1], 1)), dtype=np.float16)
+        black = white - (white - gray) * 1.5
+        res = (img - black) / ((white - black) / 255)
+        return Image.fromarray(res.clip(0, 255).astype(np.uint8), mode="RGB")
+
+    results = {}
+    for name, fn in (("float16", _apply_calibration_float16), ("lut", sc.apply_calibration)):
+        results[name] = np.asarray(fn(img, crop), dtype=np.int16)
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn(img, crop)
+        dur = (time.perf_counter() - start) / runs
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name} {img.size}: {dur * 1000:.1f}ms, peak {peak / 1024 / 1024:.1f}MiB")
+    diff = np.abs(results["float16"] - results["lut"])
+    print(f"Max difference {diff.max()}, {np.count_nonzero(diff > 1)} values differ by more than 1")
+
+
+def dbg_stitch_bench(strip_height: int = 500):
+    """Measures the time of each append, while continuing a receipt up to MAX_HEIGHT."""
+    bg = np.asarray(ScanCollector.CALIBRATION_BG)[0]
+    px = np.broadcast_to(bg, (strip_height, bg.shape[0], 3)).copy()
+    # Paper over the full height, so every strip continues the receipt
+    px[:, 300:900] = 200
+    strip = Image.fromarray(px)
+    sc = ScanCollector((300, 400))
+    for idx in range(ScanCollector.MAX_HEIGHT // strip_height):
+        start = time.perf_counter()
+        sc.append(strip)
+        dur = time.perf_counter() - start
+        print(f"Append {idx}: height {sc.cur_cropbox.height}, {dur * 1000:.1f}ms")
+    start = time.perf_counter()
+    sc.get_all()
+    print(f"Finalize: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+def dbg_band_bench(path: Path = Path(__file__).parent / "testscan.jpg", runs: int = 10):
+    """Measures cropbox and calibration of a long receipt with 1 to 4 band workers."""
+    scan = Image.open(path).convert("RGB")
+    receipt = Image.new("RGB", (scan.width, scan.height * 2))
+    receipt.paste(scan, (0, 0))
+    receipt.paste(scan, (0, scan.height))
+    base = None
+    for workers in range(1, 5):
+        sc = ScanCollector((100, 100), workers=workers)
+        cropbox = sc._cropbox(receipt)
+        img = receipt.crop((cropbox.left, cropbox.top, cropbox.right, cropbox.bottom))
+        sc.apply_calibration(img, (cropbox.left, cropbox.right))
+        start = time.perf_counter()
+        for _ in range(runs):
+            cropbox = sc._cropbox(receipt)
+            sc.apply_calibration(img, (cropbox.left, cropbox.right))
+        dur = (time.perf_counter() - start) / runs
+        base = base or dur
+        print(f"{workers} workers: {dur * 1000:.1f}ms ({base / dur:.2f}x)")
+
+
+def dbg_encoder_bench(path: Path = Path(__file__).parent / "testscan.jpg", runs: int = 5):
+    """Compares size and encode time of the JPEG settings on a calibrated and cropped scan."""
+    sc = ScanCollector((100, 100), workers=1)
+    sc.append(Image.open(path).convert("RGB"))
+    page = sc.cur_image()
+    print(f"Page {page.width}x{page.height}")
+    for quality in (60, 75, 85, 90):
+        # 2 is 4:2:0 (PIL default), 0 is 4:4:4
+        for subsampling in (2, 0):
+            for optimize, progressive in ((False, False), (True, False), (False, True)):
+                params = {
+                    "quality": quality,
+                    "subsampling": subsampling,
+                    "optimize": optimize,
+                    "progressive": progressive,
+                }
+                start = time.perf_counter()
+                for _ in range(runs):
+                    dst = io.BytesIO()
+                    page.save(dst, format="jpeg", **params)
+                dur = (time.perf_counter() - start) / runs
+                print(
+                    f"quality={quality} subsampling={subsampling} optimize={optimize:d} "
+                    f"progressive={progressive:d}: {len(dst.getvalue()) / 1024:.0f}KiB, "
+                    f"{dur * 1000:.1f}ms"
+                )
+
+
 def imshow(qimg):
     import sys
 
@@ -303,9 +636,11 @@ if __name__ == "__main__":
     # with open("last_1.png", "rb") as rf:
     #     sc.append(rf.read())
 
-    assert len(sc.get_all()) == 1
+    pages = sc.get_all()
+    assert len(pages) == 1
 
-    with open("last.jpg", "wb") as wf:
-        wf.write(sc.get_all()[0])
+    # Written in the encoded format, thus not necessarily as JPEG
+    with pages.open(0) as rf, open(f"last{pages.paths[0].suffix}", "wb") as wf:
+        shutil.copyfileobj(rf, wf)
 
     # imshow(sc.qthumbnail())
@@ -0,0 +1,202 @@
+import array
+import contextlib
+import struct
+import threading
+import time
+from collections.abc import Generator
+from pathlib import Path
+from typing import BinaryIO, Literal
+
+import usb.core
+
+SESSION_MAGIC = b"DSUSB1\n"
+# Record header: seconds since session start, kind, payload length
+RECORD = struct.Struct("<dBI")
+
+KIND_WRITE = 0
+KIND_READ = 1
+KIND_TIMEOUT = 2
+
+
+def read_records(path: Path) -> Generator[tuple[float, int, bytes], None, None]:
+    """Yields (timestamp, kind, payload) of all records of a session file."""
+    with open(path, "rb") as rf:
+        assert rf.read(len(SESSION_MAGIC)) == SESSION_MAGIC, f"Not a session file: {path}"
+        while header := rf.read(RECORD.size):
+            ts, kind, size = RECORD.unpack(header)
+            yield ts, kind, rf.read(size)
+
+
+def read_pages(path: Path) -> list[tuple[int, list[bytes]]]:
+    """Extracts the image chunks of a session file as list of (height, chunks) per page."""
+    pages = []
+    chunks = []
+    header = None
+    for _, kind, data in read_records(path):
+        if kind != KIND_READ:
+            continue
+        if header is not None:
+            chunks.append(data)
+            _, _, _, _, height = struct.unpack("<HBBII", header[2:])
+            if height > 0:
+                pages.append((height, chunks))
+                chunks = []
+            header = None
+        elif len(data) == 14 and data[0] == 0x00 and data[1] in (0x01, 0x02):
+            header = data
+    return pages
+
+
+class SessionRecorder:
+    """Wraps the usb device of a DSDriver and records all packets to a session file."""
+
+    _file: BinaryIO
+
+    def __init__(self, dev: usb.core.Device, path: Path):
+        self._dev = dev
+        # Keeps the session file open until finalize
+        self._files = contextlib.ExitStack()
+        self._file = self._files.enter_context(path.open("wb"))
+        self._file.write(SESSION_MAGIC)
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        print(f"Recording USB session to {path}")
+
+    def __getattr__(self, name: str):
+        return getattr(self._dev, name)
+
+    def _record(self, kind: int, data: bytes | memoryview) -> None:
+        with self._lock:
+            self._file.write(RECORD.pack(time.monotonic() - self._start, kind, len(data)))
+            self._file.write(data)
+
+    def write(self, endpoint: int, data: bytes, timeout: int | None = None) -> int:
+        res = self._dev.write(endpoint, data, timeout)
+        self._record(KIND_WRITE, data)
+        return res
+
+    def read(self, endpoint: int, size_or_buffer: int | array.array, timeout: int | None = None):
+        try:
+            res = self._dev.read(endpoint, size_or_buffer, timeout)
+        except usb.core.USBTimeoutError:
+            self._record(KIND_TIMEOUT, b"")
+            raise
+        if isinstance(size_or_buffer, array.array):
+            self._record(KIND_READ, memoryview(size_or_buffer)[:res])
+        else:
+            self._record(KIND_READ, res.tobytes())
+        return res
+
+    def finalize(self) -> None:
+        with self._lock:
+            self._files.close()
+        self._dev.finalize()
+
+
+class SessionReplay:
+    """
+    Replaces the usb device of a DSDriver and serves the packets of a recorded session.
+    With realtime, packets are delayed like recorded, otherwise served as fast as possible.
+    """
+
+    def __init__(self, path: Path, realtime: bool = True, loop: bool = False):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self._records = list(read_records(path))
+        self.bytes_read = 0
+        self.rewind()
+
+    def rewind(self) -> None:
+        self._idx = 0
+        self._start = time.monotonic()
+
+    @property
+    def exhausted(self) -> bool:
+        return self._idx >= len(self._records)
+
+    def next_write(self) -> bytes | None:
+        """The next packet, which the driver is expected to write."""
+        for _, kind, data in self._records[self._idx :]:
+            if kind == KIND_WRITE:
+                return data
+        return None
+
+    def _next(self, expected_kinds: tuple[int, ...]) -> tuple[int, bytes]:
+        if self.exhausted:
+            if not self.loop:
+                raise usb.core.USBError("Replayed session ended")
+            self.rewind()
+        ts, kind, data = self._records[self._idx]
+        assert kind in expected_kinds, f"Replay diverged at record {self._idx}: {kind}, {data[:64]}"
+        self._idx += 1
+        if self.realtime:
+            delay = self._start + ts - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return kind, data
+
+    def write(self, endpoint: int, data: bytes, timeout: int | None = None) -> int:
+        _, expected = self._next((KIND_WRITE,))
+        if bytes(data) != expected:
+            print(f"Replay: wrote {bytes(data)[:64]}, recorded {expected[:64]}")
+        return len(data)
+
+    def read(self, endpoint: int, size_or_buffer: int | array.array, timeout: int | None = None):
+        kind, data = self._next((KIND_READ, KIND_TIMEOUT))
+        if kind == KIND_TIMEOUT:
+            raise usb.core.USBTimeoutError("Replayed timeout")
+        self.bytes_read += len(data)
+        if isinstance(size_or_buffer, array.array):
+            size_or_buffer[: len(data)] = array.array("B", data)
+            return len(data)
+        return array.array("B", data)
+
+    def ctrl_transfer(self, *args, **kwargs):
+        # Control requests are not recorded, answer like an idle device (e.g. GET_STATUS)
+        return array.array("B", b"\x00\x00")
+
+    def reset(self) -> None:
+        pass
+
+    def finalize(self) -> None:
+        pass
+
+
+def dbg_replay(
+    path: Path, realtime: bool = False, mode: Literal["scan", "raw", "progressive"] = "scan"
+):
+    """Replays a session through the driver and reports the throughput."""
+    from scanapp.ds_driver import DSDriver, SSPRequest, XSCRequest
+
+    replay = SessionReplay(path, realtime=realtime)
+    drv = DSDriver(dev=replay)
+    pages = 0
+    start = time.perf_counter()
+    while (cmd := replay.next_write()) is not None:
+        if cmd.startswith(b"\x1bSSP"):
+            # The SSP was recorded, thus send it even if unchanged
+            drv.invalidate_parameters()
+            drv.set_parameters(SSPRequest(RESO=(150, 150)))
+        elif cmd.startswith(b"\x1bXSC"):
+            req = XSCRequest(RESO=(150, 150), AREA=(0, 0, 1294, 1650))
+            if mode == "raw":
+                pages += sum(1 for _ in drv.scan_raw(req))
+            elif mode == "progressive":
+                pages += sum(1 for band in drv.scan_progressive(req) if band.final)
+            else:
+                pages += sum(1 for _ in drv.scan(req))
+        else:
+            print(f"Replay: stopping at unhandled command {cmd[:16]}")
+            break
+    dur = time.perf_counter() - start
+    print(
+        f"Replayed {pages} pages, {replay.bytes_read / 1024:.0f}KiB in {dur:.2f}s "
+        f"({replay.bytes_read / 1024 / 1024 / dur:.2f}MiB/s, {dur / max(pages, 1):.3f}s/page)"
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    dbg_replay(Path(sys.argv[1]), realtime="--realtime" in sys.argv)
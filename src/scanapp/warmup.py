@@ -0,0 +1,95 @@
+import datetime
+import time
+from collections import deque
+
+from scanapp.scanner_control import POWERSAVING_TIMEOUT
+
+# Power saving timeout during hours of the week, which are usually busy (e.g. club evenings)
+POWERSAVING_TIMEOUT_BUSY = 30 * 60
+# Number of sessions seen in the same hour of the week, to consider it busy
+BUSY_SESSIONS = 3
+# Sessions of the last 8 weeks are considered for busy hours
+HISTORY_DURATION = 8 * 7 * 24 * 60 * 60
+# Power off a warmed up scanner, if no scan was started after this duration
+WARMUP_IDLE_TIMEOUT = 60
+
+
+class WarmupPolicy:
+    """
+    Decides when to power up the scanner before the user asks for it, and adapts the power saving
+    timeout to the usage. Keeps track of the startup latency hidden from the user and the extra
+    time the scanner was powered on for nothing.
+    """
+
+    def __init__(self):
+        # Start times of the sessions (wall clock) within the history duration
+        self._sessions: deque[datetime.datetime] = deque()
+        # Monotonic time of the running warm up and when the scanner got ready, if any
+        self._warmup_start: float | None = None
+        self._ready_at: float | None = None
+        self._avoided_startup = 0.0
+        self.hidden_latency = 0.0
+        self.wasted_power_on = 0.0
+        self.warmups = 0
+        self.warmups_used = 0
+
+    def warm_up(self, avoided_startup: float = 0.0):
+        """
+        The start page was entered after a session and the scanner is kept on (or powered up) for
+        the next user. avoided_startup is the startup, which the running scanner saves.
+        """
+        self._warmup_start = time.monotonic()
+        self._ready_at = None
+        self._avoided_startup = avoided_startup
+        self.warmups += 1
+
+    def ready(self):
+        """The scanner became ready."""
+        if self._warmup_start is not None and self._ready_at is None:
+            self._ready_at = time.monotonic()
+
+    def session_started(self, now: datetime.datetime | None = None):
+        """The user started scanning, i.e. now waits for the scanner."""
+        now = now or datetime.datetime.now()
+        self._sessions.append(now)
+        while now - self._sessions[0] > datetime.timedelta(seconds=HISTORY_DURATION):
+            self._sessions.popleft()
+        if self._warmup_start is None:
+            return
+        # Until ready, the user only waits for the remaining startup
+        self.hidden_latency += self._avoided_startup or (
+            (self._ready_at or time.monotonic()) - self._warmup_start
+        )
+        self.warmups_used += 1
+        self._warmup_start = None
+        self.report()
+
+    def warmup_expired(self):
+        """The warmed up scanner was not used and is powered off again."""
+        if self._warmup_start is None:
+            return
+        self.wasted_power_on += time.monotonic() - self._warmup_start
+        self._warmup_start = None
+        self.report()
+
+    def is_busy(self, now: datetime.datetime) -> bool:
+        return (
+            sum(
+                1
+                for session in self._sessions
+                if session.weekday() == now.weekday() and session.hour == now.hour
+            )
+            >= BUSY_SESSIONS
+        )
+
+    def powersaving_timeout(self, now: datetime.datetime | None = None) -> float:
+        """The power saving timeout for the current hour of the week."""
+        if self.is_busy(now or datetime.datetime.now()):
+            return POWERSAVING_TIMEOUT_BUSY
+        return POWERSAVING_TIMEOUT
+
+    def report(self):
+        print(
+            f"Warmup: {self.warmups_used}/{self.warmups} used, hidden {self.hidden_latency:.1f}s "
+            f"startup latency, extra {self.wasted_power_on:.1f}s powered on"
+        )
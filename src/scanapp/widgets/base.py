@@ -1,6 +1,9 @@
 import functools
+import time
 import traceback
 
+from PyQt5.QtCore import QObject, QTimer
+
 
 def exc(fn):
     @functools.wraps(fn)
@@ -12,3 +15,39 @@ def exc(fn):
             raise
 
     return _fn
+
+
+class FrameStallMonitor(QObject):
+    """Measures how long the event loop was blocked, by the lateness of a periodic timer."""
+
+    INTERVAL = 0.05
+    # Lateness counted as a stall, noticeable on the touchscreen
+    STALL = 0.1
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(self.INTERVAL * 1000))
+        self._timer.timeout.connect(self._tick)
+        self.reset()
+        self._timer.start()
+
+    def reset(self):
+        self._last = time.monotonic()
+        self.max_stall = 0.0
+        self.stalls = 0
+
+    def _tick(self):
+        now = time.monotonic()
+        stall = now - self._last - self.INTERVAL
+        self._last = now
+        self.max_stall = max(self.max_stall, stall)
+        if stall >= self.STALL:
+            self.stalls += 1
+
+    def report(self, what: str):
+        print(
+            f"Frame stalls during {what}: max {self.max_stall * 1000:.0f}ms, "
+            f"{self.stalls} over {self.STALL * 1000:.0f}ms"
+        )
+        self.reset()
@@ -2,7 +2,7 @@ import sys
 
 import schwifty
 from PyQt5.QtCore import QTimer
-from PyQt5.QtGui import QGuiApplication, QPixmap
+from PyQt5.QtGui import QGuiApplication, QImage, QPixmap
 from PyQt5.QtWidgets import (
     QDialogButtonBox,
     QHBoxLayout,
@@ -15,11 +15,15 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 
-from scanapp.env import DISABLE_IBAN_CHECK, SEND_TARGET
-from scanapp.scanner_control import ScannerState
+from scanapp.env import DISABLE_IBAN_CHECK, SCAN_AHEAD, SCANNER_WARMUP, SEND_TARGET
+from scanapp.page_encoder import MIME_TYPES
+from scanapp.page_store import PageStore
+from scanapp.scanner_control import STARTUP_DURATION, ScannerState
 from scanapp.stitcher import ScanCollector
-from scanapp.widgets.base import exc
+from scanapp.warmup import WARMUP_IDLE_TIMEOUT, WarmupPolicy
+from scanapp.widgets.base import FrameStallMonitor, exc
 from scanapp.widgets.message_dialog import MessageDialog
+from scanapp.widgets.scan_processor import ScanProcessor
 from scanapp.widgets.scanner_controller import ScannerController
 from scanapp.widgets.sendapi import ApiSender
 from scanapp.widgets.sendmail import Attachment, MailSender
@@ -36,6 +40,10 @@ class ScanWidget(QWidget):
     SCANNING_STARTING = "Scanner startet..."
     SCANNING_SCANNING = "Scannen..."
     SCANNING_RECEIVING = "Empfange Daten..."
+    SCANNING_RECEIVING_ROWS = "Empfange Daten... ({rows} Zeilen)"
+    SCANNING_BATCH = "Stapel wird gescannt... ({pages} Seiten)"
+    SCANNING_BATCH_ROWS = "Stapel wird gescannt... ({pages} Seiten, {rows} Zeilen)"
+    PROCESSING_TEXT = "Verarbeite Scan..."
     SENDING_MAIL_TEXT = "Sende Scan als Mail an Rechnungen..."
     IBAN_WRONG_INFO = '<font color="red">✕</font>'
     IBAN_CORRECT_INFO = '<font color="green">✓</font>'
@@ -53,6 +61,16 @@ class ScanWidget(QWidget):
     RECEIVING_DURATION = 1
 
     scan_collector: ScanCollector | None = None
+    # Number of pages received in the running batch scan, None if not scanning a batch
+    batch_pages: int | None = None
+    # Set if the scanner is warmed up on input on the start page
+    warmup: WarmupPolicy | None = None
+    # Number of appends to the scan collector still being processed
+    pending_pages: int = 0
+    # Show the result page, as soon as the pending pages are processed
+    donemore_pending: bool = False
+    # Whether the scan collector accepts more pages, as last reported by the processing
+    can_continue: bool = True
 
     def __init__(self, parent):
         super().__init__(parent)
@@ -61,7 +79,8 @@ class ScanWidget(QWidget):
         self.scanner.state_change.connect(self._dbg_state_update)
         self.scanner.scanner_ready.connect(self._scanner_ready)
         self.scanner.scanner_shutdown.connect(self._scanner_unready)
-        self.scanner.scanner_success.connect(self._scan_result_ready)
+        self.scanner.scanner_page.connect(self._scan_result_ready)
+        self.scanner.scanner_success.connect(self._scan_done)
         self.scanner.scanner_starting.connect(
             lambda: self._show_status(self.SCANNING_STARTING, self.SCAN_START_DURATION)
         )
@@ -71,6 +90,7 @@ class ScanWidget(QWidget):
         self.scanner.scanner_receiving.connect(
             lambda: self._show_status(self.SCANNING_RECEIVING, self.RECEIVING_DURATION)
         )
+        self.scanner.scanner_progress.connect(self._show_progress)
         self.scanner.scanner_jam.connect(self._paper_jam)
         self.scanner.scanner_no_paper.connect(lambda: self._retry_startup(is_empty=True))
 
@@ -149,11 +169,20 @@ class ScanWidget(QWidget):
         done_more.setLayout(done_more_layout)
         self.stacked_layout.addWidget(done_more)
 
+        scan_now_page = QWidget(self)
+        scan_now_layout = QVBoxLayout()
         scan_now = QPushButton(
             "Scan Starten\nRechnung mit Text oben einlegen, dann klicken\nWenn komplett gescannt, auf Scan Fertig klicken"
         )
         scan_now.clicked.connect(self._scan_now)
-        self.stacked_layout.addWidget(scan_now)
+        scan_now_layout.addWidget(scan_now, stretch=3)
+        scan_batch = QPushButton(
+            "Stapel Scannen\nMehrere Belege mit Text oben einlegen, dann klicken\nWenn alle gescannt, auf Scan Fertig klicken"
+        )
+        scan_batch.clicked.connect(self._scan_batch_now)
+        scan_now_layout.addWidget(scan_batch, stretch=1)
+        scan_now_page.setLayout(scan_now_layout)
+        self.stacked_layout.addWidget(scan_now_page)
 
         success_button = QPushButton("Senden erfolgreich!\nKlicken um zurückzukehren.")
         success_button.clicked.connect(self._show_scanner)
@@ -162,10 +191,30 @@ class ScanWidget(QWidget):
         # Set up timer for auto reset
         self.reset_timer = QTimer(self)
         self.reset_timer.setSingleShot(True)
-        self.reset_timer.timeout.connect(self.clear)
+        self.reset_timer.timeout.connect(lambda: self.clear(idle=True))
+
+        self.processor = ScanProcessor(self)
+        self.processor.thumbnail_ready.connect(self._show_collector_update)
+        self.processor.page_finalized.connect(self._page_finalized)
+        self.processor.pages_ready.connect(self._send_pages)
+        self.frame_stalls = FrameStallMonitor(self)
+
+        if SCANNER_WARMUP:
+            self.warmup = WarmupPolicy()
+            self.warmup_timer = QTimer(self)
+            self.warmup_timer.setSingleShot(True)
+            self.warmup_timer.setInterval(int(WARMUP_IDLE_TIMEOUT * 1000))
+            self.warmup_timer.timeout.connect(self._warmup_expired)
 
         self.stacked_layout.setCurrentIndex(self.PAGE_START)
 
+    @exc
+    def _warmup_expired(self, *_):
+        if self.stacked_layout.currentIndex() != self.PAGE_START:
+            return
+        self.warmup.warmup_expired()
+        self.scanner.shutdown()
+
     @exc
     def _update_iban_correct(self, *_):
         try:
@@ -215,16 +264,24 @@ class ScanWidget(QWidget):
         self._retry_startup(is_jam=True)
 
     @exc
-    def clear(self, *_):
+    def clear(self, *_, idle: bool = False):
         self.name_input.clear()
         self.purpose_input.clear()
         self.iban_input.clear()
         self.scan_button.setEnabled(False)
         self.scan_button.setText(self.INSTRUCTION_BUTTON_TEXT_START)
         self.stacked_layout.setCurrentIndex(self.PAGE_START)
-        self.scanner.shutdown()
         self.reset_timer.stop()
         self.scan_collector = None
+        if self.warmup is not None and not idle:
+            # Someone just used the scanner, the next user may be waiting already
+            print("Keeping scanner warm")
+            avoided = STARTUP_DURATION if self.scanner.can_scan() else 0.0
+            self.warmup.warm_up(avoided)
+            self.scanner.startup()
+            self.warmup_timer.start()
+        else:
+            self.scanner.shutdown()
 
     def _reset_reset_timer(self):
         self.reset_timer.stop()
@@ -232,6 +289,8 @@ class ScanWidget(QWidget):
 
     @exc
     def _scanner_ready(self, *_):
+        if self.warmup is not None:
+            self.warmup.ready()
         self.scan_button.setEnabled(True)
         self.scan_button.setText(self.INSTRUCTION_BUTTON_TEXT_INSERT)
 
@@ -246,8 +305,16 @@ class ScanWidget(QWidget):
 
     @exc
     def _show_scanner(self, *_):
+        if self.warmup is not None and self.stacked_layout.currentIndex() == self.PAGE_START:
+            self.warmup_timer.stop()
+            self.warmup.session_started()
+            self.scanner.set_powersaving_timeout(self.warmup.powersaving_timeout())
         self.stacked_layout.setCurrentIndex(self.PAGE_DONEMORE)
         self.scan_collector = ScanCollector((self.scan_preview.width(), self.scan_preview.height()))
+        self.scan_preview.clear()
+        self.pending_pages = 0
+        self.donemore_pending = False
+        self.can_continue = True
         self.stacked_layout.setCurrentIndex(self.PAGE_SCAN)
         self.name_input.setFocus()
         QGuiApplication.inputMethod().show()
@@ -296,9 +363,20 @@ class ScanWidget(QWidget):
 
     @exc
     def _scan_now(self, *_):
+        self.batch_pages = None
+        self.scan_more_button.setEnabled(False)
+        self.frame_stalls.reset()
         self._show_status(self.SCANNING_STARTING, self.SCAN_START_DURATION)
         self.scanner.scan(long=True)
 
+    @exc
+    def _scan_batch_now(self, *_):
+        self.batch_pages = 0
+        self.scan_more_button.setEnabled(False)
+        self.frame_stalls.reset()
+        self._show_status(self.SCANNING_STARTING, self.SCAN_START_DURATION)
+        self.scanner.scan(long=False, batch=True)
+
     @exc
     def _stop_scan(self, *_):
         self.scanner.stop()
@@ -323,37 +401,100 @@ class ScanWidget(QWidget):
             self.processing_progbar.setRange(0, int(duration / self.PROCBAR_UPDATE_INTERVAL))
             self.processing_procupdate.start()
 
+    @exc
+    def _show_progress(self, rows: int):
+        if self.batch_pages is not None:
+            # Keep the page count of the batch visible
+            self.processing_label.setText(
+                self.SCANNING_BATCH_ROWS.format(pages=self.batch_pages, rows=rows)
+            )
+            return
+        self.processing_label.setText(self.SCANNING_RECEIVING_ROWS.format(rows=rows))
+
     @exc
     def _scan_result_ready(self):
         assert self.scan_collector is not None
-        img = self.scanner.get_last_image()
-        if img is not None:
-            img.save("last.jpg", quality=90)
-            self.scan_collector.append(img)
+        imgs = self.scanner.get_pages()
+        # Processed in the background, the scanner is ready again already
+        self.processor.append(self.scan_collector, imgs)
+        self.pending_pages += 1
+        if self.batch_pages is not None:
+            self.batch_pages += len(imgs)
+            self.processing_label.setText(self.SCANNING_BATCH.format(pages=self.batch_pages))
+
+    @exc
+    def _show_collector_update(
+        self, collector: ScanCollector, thumbnail: QImage, can_continue: bool
+    ):
+        if collector is not self.scan_collector:
+            return
+        self.pending_pages -= 1
+        self.can_continue = can_continue
+        # With scan ahead, it was enabled when the scanner got ready, disabled if there is nothing
+        # to continue
+        if not SCAN_AHEAD or not can_continue:
+            self.scan_more_button.setEnabled(can_continue)
+        if not thumbnail.isNull():
+            self.scan_preview.setPixmap(QPixmap.fromImage(thumbnail))
+        if self.donemore_pending and self.pending_pages == 0:
+            self._show_donemore()
+
+    @exc
+    def _page_finalized(self, collector: ScanCollector, count: int):
+        print(f"Finalized image {count} of the scan")
+
+    @exc
+    def _scan_done(self):
+        self.batch_pages = None
+        if SCAN_AHEAD or self.pending_pages == 0:
+            # With scan ahead, the next sheet can be fed right away, the preview follows when the
+            # processing caught up
+            if SCAN_AHEAD and self.can_continue and self.scanner.can_scan():
+                self.scan_more_button.setEnabled(True)
             self._show_donemore()
+        else:
+            self.donemore_pending = True
+            self._show_status(self.PROCESSING_TEXT, None)
 
     @exc
     def _send_mail(self, *_):
         assert self.scan_collector is not None
-        images = self.scan_collector.get_all()
         self._show_status(self.SENDING_MAIL_TEXT, None)
+        # Sent when the pages still being processed are done
+        self.processor.finish(self.scan_collector)
+
+    @exc
+    def _send_pages(self, collector: ScanCollector, pages: PageStore | None):
+        if collector is not self.scan_collector:
+            # Form was reset meanwhile
+            return
+        if pages is None:
+            self._mail_failure("Scan konnte nicht verarbeitet werden", "-")
+            return
         if SEND_TARGET == "mail":
             sender_cls = MailSender
         elif SEND_TARGET == "api":
             sender_cls = ApiSender
         else:
             assert False, f"Invalid SEND_TARGET={SEND_TARGET}"
-        print(f"Sending {len(images)} images", file=sys.stderr)
+        print(f"Sending {len(pages)} images ({pages.size() // 1024}KiB)", file=sys.stderr)
         sender = sender_cls(
             self,
             name=self.name_input.text(),
             purpose=self.purpose_input.text(),
             iban=self.iban_input.text().replace(" ", "").upper(),
             attachments=[
-                Attachment(name=f"scan_{idx}.jpg", mime_main="image", mime_sub="jpeg", data=img)
-                for idx, img in enumerate(images)
+                Attachment(
+                    name=f"scan_{idx}{path.suffix}",
+                    mime_main=MIME_TYPES[path.suffix][0],
+                    mime_sub=MIME_TYPES[path.suffix][1],
+                    path=path,
+                )
+                for idx, path in enumerate(pages)
             ],
         )
+        # The pages are streamed from the store, remove them once sent (or saved on failure)
+        sender.finished.connect(pages.cleanup)
         sender.done.connect(self._show_success)
         sender.failure.connect(self._mail_failure)
         sender.start()
@@ -382,12 +523,11 @@ class ScanWidget(QWidget):
     def _scan_next(self, *_):
         # Bake the last image
         assert self.scan_collector is not None
-        self.scan_collector.begin_next()
+        self.processor.begin_next(self.scan_collector)
         self._initiate_scan()
 
     @exc
     def _show_donemore(self):
-        assert self.scan_collector is not None
-        self.scan_more_button.setEnabled(self.scan_collector.can_continue())
+        self.donemore_pending = False
+        self.frame_stalls.report("scan")
         self.stacked_layout.setCurrentIndex(self.PAGE_DONEMORE)
-        self.scan_preview.setPixmap(QPixmap.fromImage(self.scan_collector.qthumbnail()))
@@ -0,0 +1,91 @@
+import traceback
+from collections.abc import Callable
+
+from PIL import Image
+from PyQt5.QtCore import QCoreApplication, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from scanapp.env import SAVE_LAST_SCAN
+from scanapp.page_store import PageStore
+from scanapp.stitcher import ScanCollector
+from scanapp.widgets.base import exc
+
+
+class _Task(QRunnable):
+    def __init__(self, fn: Callable[[], None]):
+        super().__init__()
+        self._fn = fn
+
+    def run(self):
+        self._fn()
+
+
+class ScanProcessor(QObject):
+    """Runs the ScanCollector of the received pages on a worker thread, one task after another."""
+
+    # The collector processed pages: collector, thumbnail, can_continue
+    thumbnail_ready = pyqtSignal(object, QImage, bool)
+    # The collector finalized an image: collector, number of finalized images
+    page_finalized = pyqtSignal(object, int)
+    # All pages of the collector are encoded: collector, PageStore or None on errors
+    pages_ready = pyqtSignal(object, object)
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self._pool = QThreadPool(self)
+        # A single thread keeps the tasks in order, the collector is not thread safe
+        self._pool.setMaxThreadCount(1)
+        QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+
+    def shutdown(self):
+        """Drops the queued tasks and waits for the running one."""
+        self._pool.clear()
+        self._pool.waitForDone()
+
+    def append(self, collector: ScanCollector, imgs: list[Image.Image]):
+        self._pool.start(_Task(lambda: self._append(collector, imgs)))
+
+    def begin_next(self, collector: ScanCollector):
+        self._pool.start(_Task(lambda: self._begin_next(collector)))
+
+    def finish(self, collector: ScanCollector):
+        """Finalizes the collector after the pending tasks, emits pages_ready."""
+        self._pool.start(_Task(lambda: self._finish(collector)))
+
+    @exc
+    def _append(self, collector: ScanCollector, imgs: list[Image.Image]):
+        finalized = len(collector.pages)
+        try:
+            for img in imgs:
+                if SAVE_LAST_SCAN:
+                    img.save("last.jpg", quality=90)
+                collector.append(img)
+        finally:
+            # Also on errors, the widget waits for it
+            if collector.cur_img_thumbnail is None:
+                # Nothing scanned yet
+                thumbnail = QImage()
+            else:
+                # Copy, as the thumbnail refers to the bytes of the collector
+                thumbnail = collector.qthumbnail().copy()
+            self.thumbnail_ready.emit(collector, thumbnail, collector.can_continue())
+        if len(collector.pages) > finalized:
+            self.page_finalized.emit(collector, len(collector.pages))
+
+    @exc
+    def _begin_next(self, collector: ScanCollector):
+        finalized = len(collector.pages)
+        collector.begin_next()
+        if len(collector.pages) > finalized:
+            self.page_finalized.emit(collector, len(collector.pages))
+
+    @exc
+    def _finish(self, collector: ScanCollector):
+        pages: PageStore | None = None
+        try:
+            pages = collector.get_all()
+        except (OSError, ValueError):
+            # E.g. the page store is full, the widget waits for the signal anyway
+            traceback.print_exc()
+        finally:
+            self.pages_ready.emit(collector, pages)
@@ -1,12 +1,15 @@
+import threading
+
 from PIL import Image
 from PyQt5.QtCore import QObject, pyqtSignal
 
+from scanapp.env import SCANNER_PROCESS
 from scanapp.scanner_control import ScannerControl, ScannerState
+from scanapp.scanner_process import ScannerProcess
 
 
 class ScannerController(QObject):
     _state: ScannerState = ScannerState.PowerDown
-    _last_image: Image.Image | None = None
 
     # Called whenever the state changes
     state_change = pyqtSignal(ScannerState)
@@ -20,30 +23,40 @@ class ScannerController(QObject):
     scanner_starting = pyqtSignal()
     scanner_running = pyqtSignal(float)
     scanner_receiving = pyqtSignal()
+    scanner_progress = pyqtSignal(int)
+    # A page was received, fetch it with get_pages()
+    scanner_page = pyqtSignal()
     scanner_success = pyqtSignal()
     scanner_jam = pyqtSignal()
     scanner_no_paper = pyqtSignal()
 
     def __init__(self, parent):
         super().__init__(parent)
-        self.ctrl = ScannerControl()
+        self._pages_lock = threading.Lock()
+        self._pages: list[Image.Image] = []
+        self.ctrl = ScannerProcess() if SCANNER_PROCESS else ScannerControl()
         self.ctrl.state_change = self.state_change.emit
         self.ctrl.scanner_ready = self.scanner_ready.emit
         self.ctrl.scanner_shutdown = self.scanner_shutdown.emit
         self.ctrl.scanner_starting = self.scanner_starting.emit
         self.ctrl.scanner_running = self.scanner_running.emit
         self.ctrl.scanner_receiving = self.scanner_receiving.emit
-        self.ctrl.scanner_success = self._scanner_success
+        self.ctrl.scanner_progress = self.scanner_progress.emit
+        self.ctrl.scanner_page = self._scanner_page
+        self.ctrl.scanner_success = self.scanner_success.emit
         self.ctrl.scanner_jam = self.scanner_jam.emit
         self.ctrl.scanner_no_paper = self.scanner_no_paper.emit
 
-    def _scanner_success(self, img: Image.Image):
-        self._last_image = img
-        self.scanner_success.emit()
+    def _scanner_page(self, img: Image.Image):
+        with self._pages_lock:
+            self._pages.append(img)
+        self.scanner_page.emit()
 
-    def get_last_image(self) -> Image.Image | None:
-        res = self._last_image
-        self._last_image = None
+    def get_pages(self) -> list[Image.Image]:
+        """Returns the pages received since the last call."""
+        with self._pages_lock:
+            res = self._pages
+            self._pages = []
         return res
 
     def startup(self):
@@ -60,8 +73,14 @@ class ScannerController(QObject):
     def reset(self):
         return self.ctrl.reset()
 
+    def set_powersaving_timeout(self, timeout: float):
+        self.ctrl.powersaving_timeout = timeout
+
     def stop(self):
         self.ctrl.scan_stop()
 
-    def scan(self, long: bool):
-        return self.ctrl.scan(long)
+    def abort(self):
+        self.ctrl.scan_abort()
+
+    def scan(self, long: bool, batch: bool = False):
+        return self.ctrl.scan(long, batch)
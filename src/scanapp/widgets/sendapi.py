@@ -1,6 +1,11 @@
 import datetime
 import json
 import os
+import shutil
+import uuid
+from collections.abc import Iterator
+from contextlib import closing
+from pathlib import Path
 
 import requests
 from PyQt5.QtCore import QThread, pyqtSignal
@@ -9,6 +14,80 @@ from scanapp.env import API_KEY, API_TARGET
 from scanapp.widgets.base import exc
 from scanapp.widgets.sendmail import Attachment
 
+# Bytes read from a page file at once while uploading
+UPLOAD_BLOCK = 64 * 1024
+
+
+class MultipartBody:
+    """
+    A multipart/form-data body, which reads the attached files while uploading instead of loading
+    them. Has a length, thus requests sends it with a Content-Length instead of chunked.
+    """
+
+    def __init__(self, fields: list[tuple[str, str]], files: list[tuple[str, Attachment]]):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._parts: list[bytes | Path] = []
+        for name, value in fields:
+            self._parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+                + value.encode()
+                + b"\r\n"
+            )
+        for name, attachment in files:
+            self._parts.append(
+                (
+                    f"--{boundary}\r\n"
+                    f'Content-Disposition: form-data; name="{name}"; filename="{attachment.name}"\r\n'
+                    f"Content-Type: {attachment.mime_main}/{attachment.mime_sub}\r\n\r\n"
+                ).encode()
+            )
+            self._parts.append(attachment.path)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{boundary}--\r\n".encode())
+        self._len = sum(
+            part.stat().st_size if isinstance(part, Path) else len(part) for part in self._parts
+        )
+        self._blocks = self._read_blocks()
+        self._buf = bytearray()
+        self._pos = 0
+
+    def _read_blocks(self) -> Iterator[bytes]:
+        for part in self._parts:
+            if isinstance(part, Path):
+                with open(part, "rb") as rf:
+                    while data := rf.read(UPLOAD_BLOCK):
+                        yield data
+            else:
+                yield part
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        while chunk := self.read(UPLOAD_BLOCK):
+            yield chunk
+
+    def tell(self) -> int:
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buf) < size:
+            block = next(self._blocks, None)
+            if block is None:
+                break
+            self._buf += block
+        if size < 0:
+            size = len(self._buf)
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        # Closes the file being read
+        self._blocks.close()
+
 
 class ApiSender(QThread):
     done = pyqtSignal()
@@ -22,31 +101,22 @@ class ApiSender(QThread):
             "iban": iban,
         }
         self.attachments = attachments
-        self.files = (
-            ("name", (None, name)),
-            ("purpose", (None, purpose)),
-            ("iban", (None, iban)),
-            *(
-                (
-                    "files",
-                    (
-                        attachment.name,
-                        attachment.data,
-                        f"{attachment.mime_main}/{attachment.mime_sub}",
-                    ),
-                )
-                for attachment in attachments
-            ),
-        )
 
     @exc
     def run(self):
         try:
-            r = requests.post(
-                API_TARGET,
-                headers={"X-Api-Key": API_KEY},
-                files=self.files,
-            )
+            # The body opens the files, thus it is built on the sending thread
+            with closing(
+                MultipartBody(
+                    list(self.json_data.items()),
+                    [("files", attachment) for attachment in self.attachments],
+                )
+            ) as body:
+                r = requests.post(
+                    API_TARGET,
+                    headers={"X-Api-Key": API_KEY, "Content-Type": body.content_type},
+                    data=body,
+                )
             r.raise_for_status()
             print("Successfully sent mail via API")
         except Exception as e:
@@ -56,8 +126,7 @@ class ApiSender(QThread):
             with open(f"{filename_base}.json", "w") as wf:
                 json.dump(self.json_data, wf, indent=2)
             for attachment in self.attachments:
-                with open(f"{filename_base}.{attachment.name}", "wb") as wbf:
-                    wbf.write(attachment.data)
+                shutil.copyfile(attachment.path, f"{filename_base}.{attachment.name}")
             self.failure.emit(str(e), filename_base)
         else:
             self.done.emit()
@@ -1,8 +1,15 @@
+import base64
 import datetime
 import os
+import shutil
 import smtplib
+import tempfile
+import uuid
 from dataclasses import dataclass
 from email.message import EmailMessage
+from email.policy import SMTP
+from pathlib import Path
+from typing import BinaryIO
 
 from PyQt5.QtCore import QThread, pyqtSignal
 
@@ -15,6 +22,7 @@ from scanapp.env import (
     MAIL_START_TLS,
     MAIL_TO,
     MAIL_USER,
+    PAGE_STORE_DIR,
 )
 from scanapp.widgets.base import exc
 
@@ -24,7 +32,21 @@ class Attachment:
     name: str
     mime_main: str
     mime_sub: str
-    data: bytes
+    # The file is streamed when sending, never loaded as a whole
+    path: Path
+
+
+# Bytes of an attachment encoded at once, a multiple of 57 bytes (i.e. full base64 lines)
+BASE64_CHUNK = 57 * 1024
+
+
+# Bytes of the message sent at once over SMTP
+SMTP_BLOCK = 64 * 1024
+
+
+def _write_headers(wf: BinaryIO, msg: EmailMessage):
+    wf.writelines(msg.policy.fold_binary(name, value) for name, value in msg.items())
+    wf.write(b"\r\n")
 
 
 class MailSender(QThread):
@@ -42,25 +64,76 @@ class MailSender(QThread):
         )
         self.attachments = attachments
 
-    @exc
-    def run(self):
-        # Create a text/plain message
-        msg = EmailMessage()
-        msg.set_content(self.text.encode(), maintype="text", subtype="text")
-
-        # me == the sender's email address
-        # you == the recipient's email address
+    def _write_message(self, wf: BinaryIO):
+        """Writes the message with the attachments base64 encoded chunk by chunk."""
+        boundary = uuid.uuid4().hex.encode()
+        msg = EmailMessage(policy=SMTP)
         msg["Subject"] = self.subject
         msg["From"] = MAIL_FROM
         msg["To"] = MAIL_TO
+        msg["MIME-Version"] = "1.0"
+        msg["Content-Type"] = f'multipart/mixed; boundary="{boundary.decode()}"'
+        _write_headers(wf, msg)
+
+        text = EmailMessage(policy=SMTP)
+        text.set_content(self.text.encode(), maintype="text", subtype="text")
+        wf.write(b"--" + boundary + b"\r\n")
+        wf.write(text.as_bytes())
         for attachment in self.attachments:
-            msg.add_attachment(
-                attachment.data,
-                maintype=attachment.mime_main,
-                subtype=attachment.mime_sub,
-                filename=attachment.name,
-            )
+            part = EmailMessage(policy=SMTP)
+            part["Content-Type"] = f"{attachment.mime_main}/{attachment.mime_sub}"
+            part["Content-Transfer-Encoding"] = "base64"
+            part.add_header("Content-Disposition", "attachment", filename=attachment.name)
+            wf.write(b"\r\n--" + boundary + b"\r\n")
+            _write_headers(wf, part)
+            with open(attachment.path, "rb") as rf:
+                while chunk := rf.read(BASE64_CHUNK):
+                    wf.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+        wf.write(b"\r\n--" + boundary + b"--\r\n")
+
+    def _send_message(self, s: smtplib.SMTP, rf: BinaryIO):
+        """Like SMTP.send_message, but streams the written message in blocks."""
+        s.ehlo_or_helo_if_needed()
+        code, resp = s.mail(MAIL_FROM)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, resp, MAIL_FROM)
+        code, resp = s.rcpt(MAIL_TO)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({MAIL_TO: (code, resp)})
+        code, resp = s.docmd("data")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        block = bytearray()
+        for line in rf:
+            # Dot stuffing, the lines already end with CRLF
+            if line.startswith(b"."):
+                block += b"."
+            block += line
+            if len(block) >= SMTP_BLOCK:
+                s.send(block)
+                block.clear()
+        block += b".\r\n"
+        s.send(block)
+        code, resp = s.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+
+    @exc
+    def run(self):
+        # The message is spooled to a file, so its size does not matter for the memory
+        with tempfile.TemporaryFile(dir=PAGE_STORE_DIR) as spool:
+            try:
+                self._write_message(spool)
+            except OSError as e:
+                # E.g. a page missing or the spool full, nothing could be saved
+                print(f"Failed to write mail: {e!r}")
+                self.failure.emit(str(e), "-")
+            else:
+                spool.seek(0)
+                self._send(spool)
+        self.done.emit()
 
+    def _send(self, spool: BinaryIO):
         # Send the message via our own SMTP server.
         try:
             if MAIL_SSL:
@@ -71,7 +144,7 @@ class MailSender(QThread):
                 s.starttls()
             if MAIL_USER and MAIL_PASSWORD:
                 s.login(MAIL_USER, MAIL_PASSWORD)
-            s.send_message(msg)
+            self._send_message(s, spool)
             s.quit()
             print("Successfully sent mail")
         except Exception as e:
@@ -79,7 +152,7 @@ class MailSender(QThread):
             os.makedirs("failed_mails", exist_ok=True)
             filename = f"failed_mails/{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.eml"
             print(f"Saving to {filename}")
+            spool.seek(0)
             with open(filename, "wb") as wf:
-                wf.write(msg.as_bytes())
+                shutil.copyfileobj(spool, wf)
             self.failure.emit(str(e), filename)
-        self.done.emit()